@@ -0,0 +1,239 @@
+"""
+Benchmark lightwait on synthetic markdown corpora
+
+Times each public LightWait method and each stage of generate on corpora
+of increasing size, recording wall time and peak traced memory, and writes
+the results as JSON so runs on different commits can be compared.
+Runs offline, with the lightwait HOME in a temporary directory.
+
+    $ python -m benchmarks.bench_lightwait --sizes 100,1000 --output before.json
+    $ python -m benchmarks.bench_lightwait --sizes 100,1000 --compare before.json
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from lightwait.lightwait import LightWait
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+# stages of generate, timed within a single generate call
+STAGES = [
+    "_prepare_stage",
+    "_generate_assets",
+    "_precompile_templates",
+    "_generate_images",
+    "_related_posts",
+    "_generate_posts",
+    "_generate_indexes",
+    "_generate_rss",
+    "_generate_search",
+    "_generate_sitemap",
+    "_compress_outputs",
+    "_publish",
+]
+WORDS = ("light wait blog markdown static site fast minimal content feed index tag post python "
+         "render template cache build deploy server page archive search image style theme code "
+         "data model network latency throughput memory disk stream parallel process thread").split()
+
+
+class BenchLightWait(LightWait):
+    """LightWait with its HOME in a benchmark directory"""
+    home: Optional[Path] = None
+
+    def _get_home_path(self) -> Path:
+        return self.home
+
+
+class Measure(object):
+    """collects wall time and peak traced memory of named steps"""
+
+    def __init__(self, memory: bool):
+        self.memory = memory
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def run(self, name: str, fn: Callable, *args, **kwargs) -> Any:
+        if self.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            result = {"seconds": round(elapsed, 6)}
+            if self.memory:
+                result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.results[name] = result
+
+    def wrap_stages(self, lw: LightWait, prefix: str) -> None:
+        """time each generate stage of lw, as prefix.stage, whenever it is called"""
+        for stage in STAGES:
+            method = getattr(lw, stage)
+
+            @functools.wraps(method)
+            def timed(*args, _stage=stage, _method=method, **kwargs):
+                if self.memory:
+                    tracemalloc.reset_peak()
+                start = time.perf_counter()
+                try:
+                    return _method(*args, **kwargs)
+                finally:
+                    result = {"seconds": round(time.perf_counter() - start, 6)}
+                    if self.memory:
+                        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                    self.results[f"{prefix}.{_stage}"] = result
+            setattr(lw, stage, timed)
+
+    def unwrap_stages(self, lw: LightWait) -> None:
+        for stage in STAGES:
+            lw.__dict__.pop(stage, None)
+
+
+def make_corpus(target: Path, size: int, seed: int = 1) -> List[Path]:
+    """
+    Write size markdown files with front-matter. Tags follow a zipf like
+    distribution over a vocabulary growing with the corpus, post lengths vary
+    """
+    rnd = random.Random(seed)
+    target.mkdir(parents=True, exist_ok=True)
+    tags = [f"tag{i}" for i in range(max(10, size // 50))]
+    weights = [1 / (rank + 1) for rank in range(len(tags))]
+    start = date(2010, 1, 1)
+    paths = []
+    for i in range(size):
+        post_tags = sorted(set(rnd.choices(tags, weights=weights, k=rnd.randint(1, 4))))
+        day = start + timedelta(days=rnd.randint(0, 365 * 12))
+        lines = [
+            f"[//]: # (title:post-{i:06d})\n",
+            f"[//]: # (description:{' '.join(rnd.choices(WORDS, k=8))})\n",
+            f"[//]: # (tags:{','.join(post_tags)})\n",
+            f"[//]: # (date:{day.strftime('%d %b %Y')})\n",
+            f"# {' '.join(rnd.choices(WORDS, k=5))}\n\n",
+        ]
+        for _ in range(int(rnd.lognormvariate(1.5, 0.6)) + 1):
+            kind = rnd.random()
+            if kind < 0.1:
+                lines.append(f"## {' '.join(rnd.choices(WORDS, k=4))}\n\n")
+            elif kind < 0.2:
+                lines.extend(f"* {' '.join(rnd.choices(WORDS, k=6))}\n" for _ in range(rnd.randint(2, 6)))
+                lines.append("\n")
+            elif kind < 0.25:
+                lines.append("    " + "\n    ".join(" ".join(rnd.choices(WORDS, k=6)) for _ in range(4)) + "\n\n")
+            else:
+                words = rnd.choices(WORDS, k=rnd.randint(30, 150))
+                words[0] = f"[{words[0]}](https://example.com/{words[0]})"
+                lines.append(" ".join(words) + "\n\n")
+        path = target / f"post-{i:06d}.md"
+        path.write_text("".join(lines))
+        paths.append(path)
+    return paths
+
+
+def bench_size(size: int, workdir: Path, jobs: int, memory: bool) -> Dict[str, Dict[str, float]]:
+    measure = Measure(memory)
+    corpus = make_corpus(workdir / "corpus", size)
+    extra = make_corpus(workdir / "extra", 1, seed=size + 1)[0]
+    extra = extra.rename(extra.with_name("extra.md"))
+    home = workdir / "home"
+    home.mkdir()
+    docroot = workdir / "docroot"
+    docroot.mkdir()
+    BenchLightWait.home = home
+
+    lw = measure.run("init", BenchLightWait, False)
+    measure.run("post_many", lw.post_many, corpus, jobs=jobs)
+    measure.wrap_stages(lw, "generate_full")
+    measure.run("generate_full", lw.generate, docroot, jobs=jobs)
+    measure.unwrap_stages(lw)
+    measure.wrap_stages(lw, "generate_unchanged")
+    measure.run("generate_unchanged", lw.generate, docroot, jobs=jobs)
+    measure.unwrap_stages(lw)
+
+    measure.run("post", lw.post, extra, title="extra-post")
+    measure.wrap_stages(lw, "generate_one_post")
+    measure.run("generate_one_post", lw.generate, docroot, jobs=jobs)
+    measure.unwrap_stages(lw)
+
+    edited = lw.markdown / "post-000000.md"
+    edited.write_text(edited.read_text() + "\nedited\n")
+    measure.run("generate_one_edit", lw.generate, docroot, jobs=jobs)
+
+    export_dir = workdir / "export"
+    export_dir.mkdir()
+    measure.run("export", lw.export, export_dir)
+
+    # whole command line runs, including interpreter startup and imports
+    measure.run("cli_help", run_cli, home, "--help")
+    measure.run("cli_export", run_cli, home, "export", export_dir.as_posix())
+    return measure.results
+
+
+def run_cli(home: Path, *args: str) -> None:
+    subprocess.run([sys.executable, "-m", "lightwait.cli", *args],
+                   env={**os.environ, "HOME": home.as_posix()}, capture_output=True, check=True)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: List[int], jobs: int = 1, memory: bool = True) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "jobs": jobs,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {}
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix=f"lw-bench-{size}-") as workdir:
+            report["results"][str(size)] = bench_size(size, Path(workdir), jobs, memory)
+    return report
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    for size, results in report["results"].items():
+        print(f"\n{size} posts")
+        base = (baseline or {}).get("results", {}).get(size, {})
+        for name, result in results.items():
+            line = f"  {name:<45} {result['seconds']:>10.3f}s"
+            if "peak_bytes" in result:
+                line += f" {result['peak_bytes'] / 1e6:>9.1f}MB"
+            if name in base and base[name]["seconds"] > 0:
+                line += f"  x{result['seconds'] / base[name]['seconds']:.2f}"
+            print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark lightwait on synthetic corpora")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma separated corpus sizes")
+    parser.add_argument("--jobs", type=int, default=1, help="jobs passed to post_many and generate")
+    parser.add_argument("--no-memory", action="store_true", help="do not trace memory, which slows timing")
+    parser.add_argument("--output", type=Path, default=None, help="write results as JSON to this file")
+    parser.add_argument("--compare", type=Path, default=None, help="JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    report = run([int(s) for s in args.sizes.split(",")], jobs=args.jobs, memory=not args.no_memory)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(report, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
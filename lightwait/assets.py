@@ -0,0 +1,56 @@
+import gzip
+import re
+from pathlib import Path
+from typing import List
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# assets given a content hash in their name, so they can be cached forever
+FINGERPRINT_SUFFIXES = (".css", ".js")
+# outputs written with precompressed siblings
+COMPRESS_SUFFIXES = (".html", ".css", ".xml", ".js", ".json")
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+_CSS_DECLARATIONS = re.compile(r"{[^{}]*}")
+
+
+def minify_css(css: str) -> str:
+    """remove comments and whitespace which do not change the meaning of css"""
+    css = _CSS_COMMENT.sub("", css)
+    css = _CSS_SPACE.sub(" ", css)
+    css = _CSS_PUNCTUATION.sub(r"\1", css)
+    # only within declaration blocks, as a space before ':' in a selector is meaningful
+    css = _CSS_DECLARATIONS.sub(lambda m: m.group(0).replace(": ", ":"), css)
+    return css.replace(";}", "}").strip()
+
+
+def fingerprint(rel_path: str, digest: str) -> str:
+    """name of an asset including the start of its content hash: css/main.css to css/main.3f9a1c2b.css"""
+    path = Path(rel_path)
+    return path.with_name(f"{path.stem}.{digest[:8]}{path.suffix}").as_posix()
+
+
+def compressed_paths(path: Path) -> List[Path]:
+    """the precompressed siblings compress() writes for the given file"""
+    suffixes = [".gz"] if brotli is None else [".gz", ".br"]
+    return [path.with_name(path.name + suffix) for suffix in suffixes]
+
+
+def compress(path: Path) -> List[Path]:
+    """
+    Write gzip, and brotli if available, siblings of the given file,
+    for web servers which serve precompressed content
+    """
+    data = path.read_bytes()
+    written = compressed_paths(path)
+    for sibling in written:
+        if sibling.suffix == ".gz":
+            # fixed mtime so unchanged content compresses to identical bytes
+            sibling.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+        else:
+            sibling.write_bytes(brotli.compress(data))
+    return written
@@ -1,15 +1,62 @@
+import cProfile
+import functools
 import os
+import time
 from pathlib import Path
+from typing import Optional
 import click
+from lightwait.export import archive_mode
 from lightwait.lightwait import LightWait
 from lightwait.exception import LightwaitException
 
 
 @click.group()
 @click.option('--debug/--no-debug', default=False)
+@click.option('--profile', is_flag=True, default=False, help='Print the time taken by each stage and the slowest posts')
+@click.option('--profile-output',
+              default=None,
+              type=click.Path(dir_okay=False, path_type=Path),
+              help='Write a JSON trace (.json) or a cProfile dump (any other name) of the command')
 @click.pass_context
-def cli(ctx, debug):
-    ctx.obj = LightWait(debug)
+def cli(ctx, debug, profile, profile_output):
+    if profile or profile_output is not None:
+        profiler = None
+        if profile_output is not None and profile_output.suffix != ".json":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        ctx.call_on_close(lambda: _finish_profile(ctx.obj, profile, profile_output, profiler))
+
+
+def pass_lightwait(f):
+    """
+    Pass the LightWait of the command, created on first use
+    so --help and usage errors do not read config or install HOME
+    """
+    @click.pass_context
+    def new_func(ctx, *args, **kwargs):
+        root = ctx.find_root()
+        if root.obj is None:
+            root.obj = LightWait(root.params['debug'])
+        return ctx.invoke(f, root.obj, *args, **kwargs)
+    return functools.update_wrapper(new_func, f)
+
+
+def _finish_profile(lightwait: Optional[LightWait],
+                    profile: bool,
+                    profile_output: Optional[Path],
+                    profiler: Optional[cProfile.Profile]) -> None:
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_output.as_posix())
+        print(f"Wrote profile to {profile_output}")
+    report = None if lightwait is None else lightwait.last_report
+    if report is None:
+        return
+    if profile:
+        print(report.summary())
+    if profile_output is not None and profiler is None:
+        report.write_trace(profile_output)
+        print(f"Wrote trace to {profile_output}")
 
 
 @cli.command()
@@ -17,8 +64,9 @@ def cli(ctx, debug):
 @click.option('--title', '-n', default=None, help='Title of the post')
 @click.option('--description', '-d', default=None, help='Description of the post')
 @click.option('--tags', '-t', default=None, help='Tag or tag list')
-@click.pass_obj
-def post(lightwait: LightWait, file: Path, title: str, description: str, tags: str):
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of processes rendering posts')
+@pass_lightwait
+def post(lightwait: LightWait, file: Path, title: str, description: str, tags: str, jobs: int):
     """
     Create a blog post using FILE
     The initial lines in the FILE can describe metadata
@@ -29,7 +77,7 @@ def post(lightwait: LightWait, file: Path, title: str, description: str, tags: s
                        title=title,
                        description=description,
                        tags=tags)
-        lightwait.generate()
+        lightwait.generate(jobs=jobs)
         print(f"Published post for {file}")
     except LightwaitException as le:
         print(le)
@@ -37,45 +85,164 @@ def post(lightwait: LightWait, file: Path, title: str, description: str, tags: s
 
 @cli.command()
 @click.argument('src_dir', type=click.Path(exists=True, path_type=Path))
-@click.pass_obj
-def post_all(lightwait: LightWait, src_dir: Path):
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of workers importing and rendering posts')
+@pass_lightwait
+def post_all(lightwait: LightWait, src_dir: Path, jobs: int):
     """
     Create a blog post for each file in SRC_DIR
     The initial lines in each file can describe metadata
     """
-    for file in os.listdir(src_dir.as_posix()):
-        if file.endswith(".md"):
-            file_path = os.path.join(src_dir.as_posix(), file)
-            try:
-                lightwait.post(Path(file_path))
-                print(f"Created post for {file}")
-            except LightwaitException as le:
-                print(le)
-    lightwait.generate()
+    files = sorted(src_dir / file for file in os.listdir(src_dir.as_posix()) if file.endswith(".md"))
+    for file, error in lightwait.post_many(files, jobs=jobs).items():
+        if error is None:
+            print(f"Created post for {file.name}")
+        else:
+            print(error)
+    lightwait.generate(jobs=jobs)
     print(f"Published posts from {src_dir}")
 
 
+@cli.command()
+@click.argument('title')
+@click.option('--file', '-f', 'file', default=None, type=click.Path(exists=True, path_type=Path),
+              help='Markdown replacing that of the post')
+@click.option('--description', '-d', default=None, help='Description of the post')
+@click.option('--tags', '-t', default=None, help='Tag or tag list')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of processes rendering posts')
+@pass_lightwait
+def update(lightwait: LightWait, title: str, file: Path, description: str, tags: str, jobs: int):
+    """
+    Change the blog post titled TITLE
+    The initial lines in the FILE can describe metadata,
+    metadata not given is kept
+    """
+    try:
+        lightwait.update(title,
+                         src_path=file,
+                         description=description,
+                         tags=tags)
+        lightwait.generate(jobs=jobs)
+        print(f"Updated post {title}")
+    except LightwaitException as le:
+        print(le)
+
+
+@cli.command()
+@click.argument('title')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of processes rendering posts')
+@pass_lightwait
+def delete(lightwait: LightWait, title: str, jobs: int):
+    """
+    Remove the blog post titled TITLE and its content
+    """
+    try:
+        lightwait.delete(title)
+        lightwait.generate(jobs=jobs)
+        print(f"Deleted post {title}")
+    except LightwaitException as le:
+        print(le)
+
+
 @cli.command()
 @click.option('--docroot', '-d',
               default=None,
               type=click.Path(exists=True, path_type=Path),
               help='Generate static content to this docroot')
-@click.pass_obj
-def generate(lightwait: LightWait, docroot: Path):
+@click.option('--full/--incremental', default=False, help='Rebuild all content, even if unchanged')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of processes rendering posts')
+@pass_lightwait
+def generate(lightwait: LightWait, docroot: Path, full: bool, jobs: int):
     """
     Create html and rss content within given DOCROOT
     """
-    lightwait.generate(docroot)
+    lightwait.generate(docroot, full=full, jobs=jobs)
+
+
+@cli.command()
+@click.option('--docroot', '-d',
+              default=None,
+              type=click.Path(path_type=Path),
+              help='Generate and serve static content from this docroot')
+@click.option('--host', default='localhost', help='Address to listen on')
+@click.option('--port', '-p', default=8080, type=int, help='Port to listen on')
+@click.option('--interval', default=0.5, type=float, help='Seconds between checks for changed files')
+@pass_lightwait
+def serve(lightwait: LightWait, docroot: Path, host: str, port: int, interval: float):
+    """
+    Serve content of DOCROOT locally, regenerating as markdown,
+    templates or static files change
+    """
+    from lightwait.server import DevServer
+    server = DevServer(lightwait, lightwait.docroot if docroot is None else docroot, host, port)
+    server.start()
+    print(f"Serving {server.docroot} at {server.url}")
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                rebuilt = server.rebuild_if_changed()
+            except Exception as e:
+                print(f"Rebuild failed: {e}")
+                continue
+            if rebuilt is not None:
+                changed, elapsed = rebuilt
+                print(f"Rebuilt for {len(changed)} changed files in {elapsed:.3f}s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+@cli.command()
+@click.option('--docroot', '-d',
+              default=None,
+              type=click.Path(path_type=Path),
+              help='Generate static content to this docroot')
+@click.option('--host', default='localhost', help='Address to listen on')
+@click.option('--port', '-p', default=8081, type=int, help='Port to listen on')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help='Number of processes rendering posts')
+@click.option('--token',
+              default=None,
+              envvar='LIGHTWAIT_TOKEN',
+              help='Secret each request must send in an X-Lightwait-Token header, generated if not given')
+@pass_lightwait
+def daemon(lightwait: LightWait, docroot: Path, host: str, port: int, jobs: int, token: str):
+    """
+    Accept post, update, delete and generate requests over local HTTP,
+    keeping metadata and templates loaded between publishes
+    """
+    from lightwait.session import LightWaitSession, SessionServer
+    session = LightWaitSession(lightwait, docroot, jobs)
+    session.generate()
+    if not token:
+        import secrets
+        token = secrets.token_urlsafe(24)
+        print(f"Requests must send the header X-Lightwait-Token: {token}")
+    server = SessionServer(session, host, port, token)
+    server.start()
+    print(f"Accepting requests at {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
 
 
 @cli.command()
-@click.argument('target_dir', type=click.Path(exists=True, path_type=Path))
-@click.pass_obj
-def export(lightwait: LightWait, target_dir: Path):
+@click.argument('target', type=click.Path(path_type=Path))
+@click.option('--jobs', '-j', default=4, type=click.IntRange(min=1), help='Number of files written at once')
+@pass_lightwait
+def export(lightwait: LightWait, target: Path, jobs: int):
     """
-    Export markdown of content to given TARGET_DIR
+    Export markdown of content to given TARGET directory,
+    or to a single archive when TARGET ends with .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz
     """
-    lightwait.export(target_dir)
+    if archive_mode(target) is None and not target.is_dir():
+        raise click.BadParameter(f"Directory '{target}' does not exist.", param_hint="'TARGET'")
+    written = lightwait.export(target, jobs=jobs)
+    print(f"Exported {len(written)} files to {target}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+# bytes read and written at a time, so memory use does not grow with post size
+CHUNK_SIZE = 1 << 16
+# target names written as a single archive rather than a directory
+TAR_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2", ".tar.xz": "w:xz"}
+ZIP_SUFFIXES = (".zip",)
+
+
+class ExportFile(object):
+    """
+    One exported markdown file: a regenerated metadata header followed by
+    the body of the stored markdown, which is everything after its
+    leading metadata comment lines
+    """
+
+    def __init__(self, name: str, header: str, markdown_path: Path, prefix: str):
+        self.name = name
+        self.header = header.encode('utf-8')
+        self.markdown_path = markdown_path
+        self.body_offset, self.body_size = ExportFile._find_body(markdown_path, prefix.encode('utf-8'))
+
+    @property
+    def size(self) -> int:
+        return len(self.header) + self.body_size
+
+    def chunks(self) -> Iterator[bytes]:
+        yield self.header
+        with self.markdown_path.open("rb") as infile:
+            infile.seek(self.body_offset)
+            while chunk := infile.read(CHUNK_SIZE):
+                yield chunk
+
+    def open(self) -> BinaryIO:
+        """a readable file of the exported bytes, for archives which read rather than accept writes"""
+        return io.BufferedReader(_ChunkReader(self.chunks()), CHUNK_SIZE)
+
+    def sha256(self) -> str:
+        h = hashlib.sha256()
+        for chunk in self.chunks():
+            h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def _find_body(markdown_path: Path, prefix: bytes) -> Tuple[int, int]:
+        """offset and size of the markdown after its leading metadata lines"""
+        with markdown_path.open("rb") as infile:
+            offset = 0
+            while (line := infile.readline()).startswith(prefix):
+                offset += len(line)
+            return offset, markdown_path.stat().st_size - offset
+
+
+class _ChunkReader(io.RawIOBase):
+    """file like reader over an iterator of byte chunks"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            self._pending = next(self._chunks, b"")
+            if not self._pending:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def archive_mode(target: Path) -> Optional[str]:
+    """the tarfile mode, or 'zip', for a target named as an archive, otherwise None"""
+    name = target.name.lower()
+    for suffix, mode in TAR_MODES.items():
+        if name.endswith(suffix):
+            return mode
+    if name.endswith(ZIP_SUFFIXES):
+        return "zip"
+    return None
+
+
+def export_to_dir(files: List[ExportFile], target_dir: Path, jobs: int = 1) -> Tuple[List[Path], List[Path]]:
+    """
+    Write each file into target_dir, several at a time on a thread pool.
+    A target with the same size and hash as its export is left untouched
+
+    @return: the targets written and the targets skipped as unchanged
+    """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(lambda f: (target_dir / f.name, _write_if_changed(f, target_dir / f.name)), files))
+    written = [target for target, changed in results if changed]
+    skipped = [target for target, changed in results if not changed]
+    return written, skipped
+
+
+def export_to_archive(files: List[ExportFile], target: Path) -> None:
+    """
+    Write every file into one tar or zip archive, named by its suffix.
+    The archive is written aside and replaces any earlier one in one step
+    """
+    import tarfile
+    import zipfile
+    mode = archive_mode(target)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        if mode == "zip":
+            with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                for f in files:
+                    with archive.open(f.name, "w", force_zip64=True) as outfile:
+                        for chunk in f.chunks():
+                            outfile.write(chunk)
+        else:
+            with tarfile.open(tmp_path, mode) as archive:
+                for f in files:
+                    info = tarfile.TarInfo(f.name)
+                    info.size = f.size
+                    info.mtime = int(f.markdown_path.stat().st_mtime)
+                    info.mode = 0o644
+                    with f.open() as infile:
+                        archive.addfile(info, infile)
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _write_if_changed(f: ExportFile, target: Path) -> bool:
+    if target.exists() and target.stat().st_size == f.size and _file_sha256(target) == f.sha256():
+        return False
+    tmp_path = target.with_name(f".{target.name}.tmp")
+    with tmp_path.open("wb") as outfile:
+        for chunk in f.chunks():
+            outfile.write(chunk)
+    os.replace(tmp_path, target)
+    return True
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as infile:
+        while chunk := infile.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from shutil import copy2
+from typing import Any, Dict, List
+from urllib.parse import unquote
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# images collected from markdown
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+# images given resized variants, gif is left alone as it may be animated
+RESIZE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+# directory of derivatives under the cache path
+MEDIA_CACHE = "media"
+# bump when derivatives would be written differently
+VERSION = 1
+# whether the missing Pillow has been reported in this process
+_reported_missing = False
+
+# target of a markdown image: ![alt](target "title") or ![alt](<target>)
+_MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\(\s*<?([^)\s>]+)")
+_SCHEME = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+
+def image_refs(text: str) -> List[str]:
+    """distinct targets of markdown images which are relative local paths"""
+    refs = {}
+    for ref in _MARKDOWN_IMAGE.findall(text):
+        if not _SCHEME.match(ref) and not ref.startswith(("/", "#")):
+            refs[ref] = None
+    return list(refs)
+
+
+def collect_images(src_path: Path, media_path: Path) -> Dict[str, str]:
+    """
+    Copy the local images referenced by the markdown into media_path,
+    each named by its content hash so an image used by many posts is kept once
+
+    @return: image targets as written in the markdown mapped to their media name
+    """
+    images = {}
+    for ref in image_refs(src_path.read_text()):
+        image_path = src_path.parent / unquote(ref)
+        if image_path.suffix.lower() not in IMAGE_SUFFIXES or not image_path.is_file():
+            continue
+        sha = hashlib.sha256(image_path.read_bytes()).hexdigest()
+        name = sha[:16] + image_path.suffix.lower()
+        target = media_path / name
+        if not target.exists():
+            _copy_into(image_path, target)
+            logging.info(f"Collected {ref} as {name}")
+        images[ref] = name
+    return images
+
+
+def _copy_into(src_path: Path, target: Path) -> None:
+    """
+    Copy to target through a temporary file of its own, as other threads or processes
+    may be collecting the same image. Their copies are identical, so whichever
+    replaces the target last wins
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".tmp", dir=target.parent)
+    os.close(fd)
+    try:
+        copy2(src_path.as_posix(), tmp_name)
+        os.replace(tmp_name, target)
+    except OSError:
+        if not target.exists():
+            raise
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+class ImageProcessor(object):
+    """
+    Writes resized variants of media images, and webp versions where
+    Pillow supports it, into a cache keyed by image and settings
+
+    Images are named by their content hash, so once an image's variants
+    and dimensions are cached it is never decoded again. Without Pillow,
+    images are used as they are
+    """
+
+    def __init__(self, media_path: Path, cache_path: Path, widths: List[int], webp: bool = True, quality: int = 80):
+        self.media_path = media_path
+        self.widths = sorted(set(widths))
+        self.webp = webp and Image is not None and features.check("webp")
+        if Image is None and (self.widths or webp):
+            _report_missing()
+        self.quality = quality
+        settings = json.dumps([VERSION, self.widths, self.webp, quality, None if Image is None else Image.__version__])
+        self.settings = hashlib.sha256(settings.encode('utf-8')).hexdigest()[:12]
+        self.cache_path = cache_path / MEDIA_CACHE / self.settings
+
+    def info(self, name: str) -> Dict[str, Any]:
+        """
+        Dimensions of the named image and its variants, writing them on first use
+
+        @return: width, height and, for each image format, a list of [width, file in the cache]
+        """
+        info_path = self.cache_path / (name + ".json")
+        if info_path.exists():
+            with info_path.open() as json_file:
+                return json.load(json_file)
+        info = self._process(name)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        tmp_path = info_path.with_name(f".{info_path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("w") as outfile:
+            json.dump(info, outfile)
+        tmp_path.replace(info_path)
+        return info
+
+    def info_all(self, names: List[str], jobs: int = 1) -> Dict[str, Dict[str, Any]]:
+        """info of each image, processing those not yet cached on a thread pool"""
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            return dict(zip(names, executor.map(self.info, names)))
+
+    def _process(self, name: str) -> Dict[str, Any]:
+        src = self.media_path / name
+        path = Path(name)
+        info: Dict[str, Any] = {"width": None, "height": None, "variants": {}}
+        if Image is None:
+            return info
+        try:
+            return self._resize(src, path, info)
+        except OSError as e:
+            logging.error(f"Unable to process image {name}, publishing it as it is: {e}")
+            return {"width": None, "height": None, "variants": {}}
+
+    def _resize(self, src: Path, path: Path, info: Dict[str, Any]) -> Dict[str, Any]:
+        with Image.open(src) as opened:
+            image = ImageOps.exif_transpose(opened)
+            info["width"], info["height"] = image.size
+            if path.suffix not in RESIZE_SUFFIXES:
+                return info
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            formats = [path.suffix] + ([".webp"] if self.webp and path.suffix != ".webp" else [])
+            for suffix in formats:
+                variants = []
+                for width in [w for w in self.widths if w < image.size[0]] + [image.size[0]]:
+                    if suffix == path.suffix and width == image.size[0]:
+                        # the original is published as it is
+                        continue
+                    height = max(1, round(image.size[1] * width / image.size[0]))
+                    variant = f"{path.stem}.{width}{suffix}"
+                    resized = image if width == image.size[0] else image.resize((width, height), Image.LANCZOS)
+                    self._save(resized, self.cache_path / variant, suffix)
+                    variants.append([width, variant])
+                info["variants"][suffix] = variants
+        logging.info(f"Processed image {path.name}")
+        return info
+
+    def _save(self, image, target: Path, suffix: str) -> None:
+        if suffix in (".jpg", ".jpeg") and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        options = {"optimize": True}
+        if suffix in (".jpg", ".jpeg", ".webp"):
+            options["quality"] = self.quality
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        image.save(tmp_path, format="JPEG" if suffix in (".jpg", ".jpeg") else suffix[1:].upper(), **options)
+        tmp_path.replace(target)
+
+
+def _report_missing() -> None:
+    global _reported_missing
+    if not _reported_missing:
+        _reported_missing = True
+        logging.info("imageWidths and imageWebp need Pillow, images are published as they are. "
+                     "Install it with pip install lightwait[images]")
+
+
+def render_info(name: str, info: Dict[str, Any], url_path: str) -> Dict[str, Any]:
+    """
+    What the markdown image extension needs to write an image:
+    its src, dimensions, and srcset candidates in its own format and as webp
+    """
+    suffix = Path(name).suffix
+    own = [[w, f"{url_path}/{f}"] for w, f in info["variants"].get(suffix, [])]
+    if own and info["width"] is not None:
+        own.append([info["width"], f"{url_path}/{name}"])
+    return {
+        "src": f"{url_path}/{name}",
+        "width": info["width"],
+        "height": info["height"],
+        "srcset": own,
+        "webp": [] if suffix == ".webp" else [[w, f"{url_path}/{f}"] for w, f in info["variants"].get(".webp", [])]
+    }
+
+
+def parse_widths(widths: str) -> List[int]:
+    return [int(w) for w in widths.split(",") if w.strip()]
+
@@ -1,20 +1,34 @@
 import logging
 import hashlib
 import json
+import os
 from datetime import datetime
-from distutils.dir_util import copy_tree
-from itertools import takewhile, dropwhile, cycle
+from importlib import resources
+from itertools import cycle
 from pathlib import Path
-from pathvalidate import sanitize_filename
-from shutil import copyfile
 from shutil import copy2
-from typing import List, Set, Dict, Optional, Any
-import pkg_resources
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import TYPE_CHECKING, List, Set, Dict, Optional, Any, Tuple, Callable
 import configparser
-from jinja2 import Environment, FileSystemLoader
-import markdown
-from feedgen.feed import FeedGenerator
+from lightwait import assets, sitemap
 from lightwait.exception import LightwaitException
+from lightwait.export import ExportFile, archive_mode, export_to_archive, export_to_dir
+from lightwait.lock import locked
+from lightwait.manifest import BuildManifest
+from lightwait.publish import Publisher
+from lightwait.report import BuildReport
+from lightwait.related import RelatedPosts
+from lightwait.search import TermCache, build_shards, doc_shards, settings as search_settings
+from lightwait.store import MetadataStore
+
+# markdown, jinja2 and feedgen are imported by the stages using them, so commands
+# which do not render, and --help, start without loading them
+if TYPE_CHECKING:
+    from importlib.abc import Traversable
+    from feedgen.feed import FeedGenerator
+    from jinja2 import Environment
+    from lightwait.render import MarkdownConverter, PostRenderer
 
 
 class LightWait(object):
@@ -32,10 +46,14 @@ class LightWait(object):
     MD_DATE = "date"
     # all keys
     ALL_KEYS = [MD_TITLE, MD_DESCRIPTION, MD_TAGS, MD_DATE]
+    # local images of a post, as written in its markdown, mapped to their name under media
+    MD_IMAGES = "images"
 
     # relative to stage path
     CONTENT = "content"
     TAG = "tag-"
+    PAGE = "page"
+    SEARCH = "search"
 
     # directory names for HOME
     LIGHTWAIT_HOME = ".lightwait"
@@ -43,9 +61,26 @@ class LightWait(object):
     METADATA = "metadata"
     TEMPLATE = "template"
     WWW = "www"
+    # images collected from posts, also their directory in the stage
+    MEDIA = "media"
     # USER modifiable config file
     CONFIG_FILE = 'lightwait.ini'
-    # metadata file holding posts
+    # record of generated outputs and their inputs
+    BUILD_MANIFEST = 'build.json'
+    # generated site, published from here to a docroot
+    STAGE = "stage"
+    # record of files published to each docroot
+    PUBLISH_RECORD = 'publish.json'
+    # lock files: metadata and markdown are read under a shared lock and changed under
+    # an exclusive one, and only one generate writes the stage at a time
+    METADATA_LOCK = 'metadata.lock'
+    BUILD_LOCK = 'build.lock'
+    # derived data which can be rebuilt at any time
+    CACHE = "cache"
+    TEMPLATE_SUFFIX = ".index"
+    # config keys which do not change generated content
+    NON_CONTENT_KEYS = ['docroot']
+    # legacy metadata file holding posts
     POSTS_METADATA_NAME = "lw_posts"
     RESERVED_NAMES = [POSTS_METADATA_NAME, ]
     # Markdown comment prefix
@@ -70,6 +105,7 @@ class LightWait(object):
         self.metadata = self.base / LightWait.METADATA
         self.template = self.base / LightWait.TEMPLATE
         self.www = self.base / LightWait.WWW
+        self.media = self.base / LightWait.MEDIA
         self.config_path = self.base / LightWait.CONFIG_FILE
         # if not installed in HOME then copy from package source
         if not self.base.exists():
@@ -86,7 +122,11 @@ class LightWait(object):
         self.config.read(self.config_path.as_posix())
         self.URL = self.config.get('lw', 'url')
         self.docroot = Path(self.config.get('lw', 'docroot'))
-        # functions which take single path param
+        # www paths mapped to their fingerprinted names, set by generate
+        self.assets: Dict[str, str] = {}
+        # report of the most recent generate
+        self.last_report: Optional[BuildReport] = None
+        # functions which take the path, first body line and modified time of the markdown
         self.md_generator = {
             LightWait.MD_TITLE: LightWait._gen_title,
             LightWait.MD_DESCRIPTION: LightWait._gen_description,
@@ -103,8 +143,7 @@ class LightWait(object):
         Given the source name of a markdown file, along with information about
         the file contents, create a 'post':
           - copy the file to the lightwait HOME directory under a unique name
-          - update 'posts' file with post metadata
-          - update 'tags' file with post per tag metadata
+          - add the post metadata to the metadata store
 
         @param src_path:
         @param title:
@@ -115,9 +154,107 @@ class LightWait(object):
         logging.info(f"Args: {src_path=} {title=} {description=} {tags=}")
         metadata = self._input_metadata(src_path, title, description, tags)
         logging.info(f"Generated metadata: {metadata}")
-        self._save_data(src_path, metadata)
+        with self._lock(LightWait.METADATA_LOCK):
+            self.refresh_metadata()
+            self._save_data(src_path, metadata)
+
+    def update(self,
+               title: str,
+               src_path: Optional[Path] = None,
+               description: Optional[str] = None,
+               tags: Optional[str] = None) -> None:
+        """
+        Change an existing post. Given a markdown file, its markdown replaces
+        that of the post and the metadata it declares replaces that of the post,
+        keeping the title. A given description or tags replace those of the post.
+        The next generate renders the post again, moves it between tag indexes
+        and removes tag indexes left empty
+
+        @param title: title of the post to change
+        @param src_path:
+        @param description:
+        @param tags:
+        @return:
+        """
+        logging.info(f"Args: {title=} {src_path=} {description=} {tags=}")
+        with self._lock(LightWait.METADATA_LOCK):
+            self.refresh_metadata()
+            metadata = self.store.get(title)
+            if metadata is None:
+                raise LightwaitException(f"No post titled {title}")
+            if src_path is not None:
+                # metadata the markdown does not declare is kept, rather than generated again
+                kept = dict(metadata, **{LightWait.MD_TAGS: ",".join(metadata[LightWait.MD_TAGS])})
+                metadata = self._input_metadata(src_path, title, description, tags, kept)
+                self._copy_markdown(src_path, metadata)
+            else:
+                if description is not None:
+                    metadata[LightWait.MD_DESCRIPTION] = description
+                if tags is not None:
+                    metadata[LightWait.MD_TAGS] = LightWait._parse_tags(tags)
+            self.store.replace(title, metadata)
+            self.store.save()
+
+    def delete(self, title: str) -> None:
+        """
+        Remove a post, its markdown and metadata.
+        The next generate removes its content and any tag index left empty,
+        and rewrites only the indexes and feeds which listed it
 
-    def generate(self, docroot: Optional[Path] = None) -> None:
+        @param title: title of the post to remove
+        @return:
+        """
+        logging.info(f"Args: {title=}")
+        with self._lock(LightWait.METADATA_LOCK):
+            self.refresh_metadata()
+            if self.store.remove(title) is None:
+                raise LightwaitException(f"No post titled {title}")
+            markdown_path = self.markdown / (title + '.md')
+            if markdown_path.exists():
+                markdown_path.unlink()
+            self.store.save()
+
+    def post_many(self, src_paths: List[Path], jobs: int = 1) -> Dict[Path, Optional[LightwaitException]]:
+        """
+        Create a post for each markdown file, using only the metadata within
+        each file. Files are parsed and copied concurrently, titles are checked
+        against the whole batch before anything is copied, and the metadata
+        store is written once. A failing file does not stop the batch:
+        the error is answered back for that file instead
+
+        @param src_paths:
+        @param jobs: number of threads parsing and copying files
+        @return: each source path mapped to its error, or None if posted
+        """
+        logging.info(f"Args: {len(src_paths)=} {jobs=}")
+        results: Dict[Path, Optional[LightwaitException]] = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            parsed = list(executor.map(self._try_input_metadata, src_paths))
+
+        with self._lock(LightWait.METADATA_LOCK):
+            self.refresh_metadata()
+            accepted = []
+            batch_titles: Set[str] = set()
+            for src_path, (metadata, error) in zip(src_paths, parsed):
+                if error is None:
+                    try:
+                        self._check_title(src_path, metadata, batch_titles)
+                        batch_titles.add(metadata[LightWait.MD_TITLE])
+                        accepted.append((src_path, metadata))
+                    except LightwaitException as le:
+                        error = le
+                results[src_path] = error
+
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                copied = list(executor.map(lambda a: self._try_copy_markdown(*a), accepted))
+            for (src_path, metadata), error in zip(accepted, copied):
+                if error is None:
+                    self.store.add(metadata)
+                results[src_path] = error
+            self.store.save()
+        return results
+
+    def generate(self, docroot: Optional[Path] = None, full: bool = False, jobs: int = 1) -> BuildReport:
         """
         Given the directory target for the generated content,
         generate blog posts from each metadata post
@@ -125,23 +262,87 @@ class LightWait(object):
         generate main and tags indexes using metadata posts,
         generate rss feed using metadata posts
 
+        Outputs whose inputs (markdown, metadata, templates and config)
+        are unchanged since the last generate are skipped, unless full is set.
+        Content is generated into a stage under the lightwait HOME, then
+        files which changed are published to the docroot, each replaced
+        in one step, and files of removed posts or tags are deleted
+
         @param docroot:
-        @return:
+        @param full: force a rebuild of every output
+        @param jobs: number of worker processes rendering posts
+        @return: timing of each stage and each rendered post
         """
-        logging.info(f"Args: {docroot=}")
+        logging.info(f"Args: {docroot=} {full=} {jobs=}")
         docroot = self.docroot if docroot is None else docroot
-        stage_path = self._prepare_stage(docroot)
-        self._generate_posts(stage_path)
-        self._generate_indexes(stage_path)
-        self._generate_rss(stage_path)
-
-    def export(self, target_dir: Path) -> None:
+        report = BuildReport()
+        with report.stage("generate"), self._lock(LightWait.BUILD_LOCK):
+            stage_path = self._prepare_stage(self.base / LightWait.STAGE)
+            with report.stage("manifest"):
+                manifest = BuildManifest(self.base / LightWait.BUILD_MANIFEST, stage_path)
+                if full:
+                    manifest.clear()
+            with report.stage("assets"):
+                self.assets = self._generate_assets(stage_path, manifest)
+            with report.stage("templates"):
+                self._precompile_templates()
+            # posts may be imported meanwhile, but not while their markdown is being read
+            with self._lock(LightWait.METADATA_LOCK, shared=True):
+                with report.stage("metadata"):
+                    self.refresh_metadata()
+                    posts = self.store.posts()
+                with report.stage("images"):
+                    images = self._generate_images(stage_path, posts, manifest, jobs)
+                related = {}
+                if self.config.getint('lw', 'relatedPosts', fallback=0) > 0:
+                    with report.stage("related"):
+                        related = self._related_posts(posts)
+                with report.stage("posts"):
+                    self._generate_posts(stage_path, posts, manifest, jobs, report, images, related)
+                with report.stage("indexes"):
+                    self._generate_indexes(stage_path, posts, manifest)
+                with report.stage("feeds"):
+                    self._generate_rss(stage_path, posts, manifest)
+                if self.config.getboolean('lw', 'searchIndex', fallback=False):
+                    with report.stage("search"):
+                        self._generate_search(stage_path, posts, manifest)
+            if self.config.getboolean('lw', 'sitemap', fallback=False):
+                with report.stage("sitemap"):
+                    self._generate_sitemap(stage_path, posts, manifest)
+            if self.config.getboolean('lw', 'precompress', fallback=False):
+                with report.stage("compress"):
+                    self._compress_outputs(manifest)
+            with report.stage("manifest"):
+                removed = manifest.prune()
+                for output in removed:
+                    logging.info(f"Removed {output.relative_to(stage_path).as_posix()}")
+                manifest.save()
+            with report.stage("publish"):
+                copied, unpublished = self._publish(stage_path, docroot)
+        report.count("posts", len(posts))
+        report.count("outputs removed", len(removed))
+        report.count("files published", len(copied))
+        report.count("files unpublished", len(unpublished))
+        self.last_report = report
+        return report
+
+    def export(self, target: Path, jobs: int = 1) -> List[Path]:
         """
-        @param target_dir:
-        @return:
+        Export the markdown of each post with its metadata as comments at the top,
+        streamed from the stored markdown in fixed size chunks
+
+        A target named as an archive (.zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz)
+        is written as a single archive, otherwise files are written into the target
+        directory, jobs at a time, skipping any whose size and hash are unchanged
+
+        @param target: directory or archive to export to
+        @param jobs: files written concurrently into a directory
+        @return: paths written
         """
-        logging.info(f"Args: {target_dir=}")
-        self._generate_output(target_dir)
+        logging.info(f"Args: {target=} {jobs=}")
+        with self._lock(LightWait.METADATA_LOCK, shared=True):
+            self.refresh_metadata()
+            return self._generate_output(target, jobs)
 
     #
     # called by init to simplify testing
@@ -155,13 +356,24 @@ class LightWait(object):
                           template: Path,
                           www: Path,
                           config: Path):
-        for d in [base, markdown, metadata, template, www]:
+        for d in [base, markdown, metadata, template, www, base / LightWait.MEDIA]:
             d.mkdir(exist_ok=True)
-        copyfile(pkg_resources.resource_filename(__package__, LightWait.CONFIG_FILE), config.as_posix())
-        copy_tree(pkg_resources.resource_filename(__package__, LightWait.TEMPLATE), template.as_posix())
-        copy_tree(pkg_resources.resource_filename(__package__, LightWait.WWW), www.as_posix())
+        package = resources.files(__package__)
+        config.write_bytes((package / LightWait.CONFIG_FILE).read_bytes())
+        LightWait._copy_resource_tree(package / LightWait.TEMPLATE, template)
+        LightWait._copy_resource_tree(package / LightWait.WWW, www)
         logging.info(f"Copied resources to: {base.as_posix()}")
 
+    @staticmethod
+    def _copy_resource_tree(src: 'Traversable', dest: Path) -> None:
+        """copy a package resource directory, which may not be on the file system"""
+        dest.mkdir(exist_ok=True)
+        for item in src.iterdir():
+            if item.is_dir():
+                LightWait._copy_resource_tree(item, dest / item.name)
+            else:
+                (dest / item.name).write_bytes(item.read_bytes())
+
     #
     # import functions, mainly metadata management
 
@@ -169,48 +381,89 @@ class LightWait(object):
                         src_path: Path,
                         title: Optional[str],
                         desc: Optional[str],
-                        tags: Optional[str]) -> Dict[str, Any]:
+                        tags: Optional[str],
+                        defaults: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """
         Given a path to some markdown and a set of optional arguments,
         answer back a fixed set of metadata.
+        Metadata missing from the markdown is taken from defaults, else generated
         """
-        file_md = self._parse_file_metadata(src_path)
+        file_md = self._parse_file_metadata(src_path, defaults)
 
         # override any file metadata with any provided arguments
         title = file_md.get(LightWait.MD_TITLE) if title is None else title
         desc = file_md.get(LightWait.MD_DESCRIPTION) if desc is None else desc
         tags = file_md.get(LightWait.MD_TAGS) if tags is None else tags
+        date = file_md.get(LightWait.MD_DATE)
+        try:
+            MetadataStore.parse_date(date)
+        except ValueError:
+            raise LightwaitException(f"Date {date} of markdown {src_path} is not like '14 Jul 2022'")
         return {
             LightWait.MD_TITLE: LightWait._to_posix(title),
             LightWait.MD_DESCRIPTION: desc,
-            LightWait.MD_TAGS: [LightWait._to_posix(tag) for tag in tags.split(",")],
-            LightWait.MD_DATE: file_md.get(LightWait.MD_DATE)
+            LightWait.MD_TAGS: LightWait._parse_tags(tags),
+            LightWait.MD_DATE: date
         }
 
+    @staticmethod
+    def _parse_tags(tags: str) -> List[str]:
+        return [LightWait._to_posix(tag) for tag in tags.split(",")]
+
     @staticmethod
     def _to_posix(src: str) -> str:
         if src in LightWait.RESERVED_NAMES:
             raise LightwaitException(f"Name {src} is reserved")
+        from pathvalidate import sanitize_filename
         return sanitize_filename(src.strip().replace(" ", "-"), replacement_text="-")
 
-    def _parse_file_metadata(self, src_path: Path) -> Dict[str, str]:
-        with open(src_path) as lines:
-            rs = list(takewhile(lambda x: x.startswith(LightWait.MD_PREFIX), lines))
-        metadata = LightWait._parse_comment_metadata(rs)
+    def _parse_file_metadata(self, src_path: Path, defaults: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        header, body_line, mtime = LightWait._read_header(src_path)
+        metadata = LightWait._parse_comment_metadata(header)
         for k in self.md_generator.keys():
             if k not in metadata:
-                metadata[k] = self.md_generator[k](src_path)
+                if defaults and k in defaults:
+                    metadata[k] = defaults[k]
+                else:
+                    metadata[k] = self.md_generator[k](src_path, body_line, mtime)
         return metadata
 
+    @staticmethod
+    def _read_header(src_path: Path) -> Tuple[List[str], Optional[str], float]:
+        """
+        Read the leading metadata comment lines of the markdown, then only as far
+        as the first line of body text, with one open and one stat of the file
+
+        @return: the metadata lines, the first body line if any, and the file modified time
+        """
+        # utf-8-sig, as a byte order mark would hide the first metadata line
+        with open(src_path, encoding='utf-8-sig') as lines:
+            mtime = os.fstat(lines.fileno()).st_mtime
+            header = []
+            in_header = True
+            body_line = None
+            while line := lines.readline():
+                if line.startswith(LightWait.MD_PREFIX):
+                    if in_header:
+                        header.append(line)
+                    continue
+                in_header = False
+                if line.strip(' #\r\n'):
+                    body_line = line
+                    break
+        return header, body_line, mtime
+
     @staticmethod
     def _parse_comment_metadata(lines: List[str]) -> Dict[str, str]:
         """format of line is
             [//]: # (key:value)
+        where the value runs to the last closing parenthesis, and may hold colons
         """
         matched = {}
         for li in lines:
-            match = li[li.find("(") + 1:li.find(")")].split(":")
-            matched[match[0]] = match[1]
+            key, sep, value = li[li.find("(") + 1:li.rfind(")")].partition(":")
+            if sep:
+                matched[key] = value
         return matched
 
     @staticmethod
@@ -218,70 +471,94 @@ class LightWait(object):
         return f"[//]: # ({key}:{value})\n"
 
     @staticmethod
-    def _gen_title(src_path: Path) -> str:
-        date = LightWait._gen_date(src_path)
+    def _gen_title(src_path: Path, body_line: Optional[str], mtime: float) -> str:
+        date = LightWait._gen_date(src_path, body_line, mtime)
         uniq = hashlib.sha256(src_path.as_posix().encode('utf-8')).hexdigest()[:6]
         title = f"{date}_{uniq}"
         return title
 
     @staticmethod
-    def _gen_description(src_path: Path) -> str:
-        with open(src_path) as lines:
-            for line in lines.readlines():
-                if not line.startswith(LightWait.MD_PREFIX):
-                    candidate = line.strip(' #\n')
-                    if len(candidate) > 0:
-                        return candidate
+    def _gen_description(src_path: Path, body_line: Optional[str], mtime: float) -> str:
+        if body_line is not None:
+            return body_line.strip(' #\r\n')
         return "no good description"
 
     @staticmethod
-    def _gen_tag(file_path: Path) -> str:
+    def _gen_tag(src_path: Path, body_line: Optional[str], mtime: float) -> str:
         return "general"
 
     @staticmethod
-    def _gen_date(file_path: Path) -> str:
-        stamp = datetime.fromtimestamp(file_path.stat().st_mtime)
+    def _gen_date(src_path: Path, body_line: Optional[str], mtime: float) -> str:
+        stamp = datetime.fromtimestamp(mtime)
         return stamp.strftime("%d %b %Y")
 
     def _save_data(self,
                    src_path: Path,
                    metadata: Dict[str, Any]) -> None:
-        markdown_name = metadata[LightWait.MD_TITLE] + '.md'
-        markdown_path = self.markdown / markdown_name
-        if not markdown_path.exists():
-            copy2(src_path.as_posix(), markdown_path.as_posix())
-            self._save_metadata(metadata)
-        else:
+        self._check_title(src_path, metadata)
+        self._copy_markdown(src_path, metadata)
+        self._save_metadata(metadata)
+
+    def _check_title(self, src_path: Path, metadata: Dict[str, Any], batch_titles: Set[str] = frozenset()) -> None:
+        title = metadata[LightWait.MD_TITLE]
+        markdown_name = title + '.md'
+        if title in batch_titles or title in self.store or (self.markdown / markdown_name).exists():
             raise LightwaitException(f"Title {markdown_name} for markdown {src_path} already exists")
 
+    def _copy_markdown(self, src_path: Path, metadata: Dict[str, Any]) -> None:
+        # images first, so markdown is only in place once its images are
+        from lightwait.images import collect_images
+        images = collect_images(src_path, self.media)
+        markdown_path = self.markdown / (metadata[LightWait.MD_TITLE] + '.md')
+        # replaced in one step, so a generate never reads partly copied markdown
+        tmp_path = markdown_path.with_name(f".{markdown_path.name}.{os.getpid()}.tmp")
+        try:
+            copy2(src_path.as_posix(), tmp_path.as_posix())
+            os.replace(tmp_path, markdown_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        if images:
+            metadata[LightWait.MD_IMAGES] = images
+        else:
+            metadata.pop(LightWait.MD_IMAGES, None)
+
+    def _try_input_metadata(self, src_path: Path) -> Tuple[Optional[Dict[str, Any]], Optional[LightwaitException]]:
+        try:
+            return self._input_metadata(src_path, None, None, None), None
+        except LightwaitException as le:
+            return None, le
+        except (OSError, ValueError) as e:
+            return None, LightwaitException(f"Unable to read metadata from {src_path}: {e}")
+
+    def _try_copy_markdown(self, src_path: Path, metadata: Dict[str, Any]) -> Optional[LightwaitException]:
+        try:
+            self._copy_markdown(src_path, metadata)
+            return None
+        except OSError as e:
+            return LightwaitException(f"Unable to copy markdown {src_path}: {e}")
+
     def _save_metadata(self, metadata: Dict[str, Any]) -> None:
-        self._update_metadata(LightWait.POSTS_METADATA_NAME, metadata)
-        for tag in metadata[LightWait.MD_TAGS]:
-            self._update_metadata(tag, metadata)
-
-    def _update_metadata(self, name: str, metadata: Dict[str, Any]) -> None:
-        posts = self._get_metadata(name)
-        posts.append(metadata)
-        self._put_metadata(name, posts)
-
-    def _get_metadata(self, name: str) -> List[Dict[str, Any]]:
-        sorted_posts = []
-        filename = name + ".json"
-        filepath = self.metadata / filename
-        if filepath.exists():
-            with filepath.open() as json_file:
-                sorted_posts = self._sort_by_date(json.load(json_file))
-        return sorted_posts
-
-    def _put_metadata(self, name: str, posts: List[Dict[str, Any]]) -> None:
-        filename = name + ".json"
-        filepath = self.metadata / filename
-        with filepath.open("w") as outfile:
-            json.dump(posts, outfile)
+        self.store.add(metadata)
+        self.store.save()
 
-    @staticmethod
-    def _sort_by_date(posts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        return sorted(posts, key=lambda x: datetime.strptime(x['date'], '%d %b %Y'), reverse=True)
+    @cached_property
+    def store(self) -> MetadataStore:
+        """post metadata, loaded once on first use"""
+        return MetadataStore(self.metadata)
+
+    def reload_metadata(self) -> None:
+        """forget metadata held in memory, so it is read again on next use"""
+        self.__dict__.pop('store', None)
+
+    def refresh_metadata(self) -> None:
+        """reload metadata held in memory if another process has saved it since"""
+        if 'store' in self.__dict__ and self.store.is_stale():
+            logging.info("Metadata changed by another process, reloading")
+            self.reload_metadata()
+
+    def _lock(self, name: str, shared: bool = False):
+        return locked(self.base / name, shared)
 
     @staticmethod
     def _get_all_tags(posts: List[Dict[str, Any]]) -> Set:
@@ -295,49 +572,313 @@ class LightWait(object):
     # Generate html
 
     def _prepare_stage(self, stage_dir: Path) -> Path:
-        copy_tree(self.www.as_posix(), stage_dir.as_posix())
+        stage_dir.mkdir(parents=True, exist_ok=True)
         return stage_dir
 
-    def _generate_posts(self, stage_path: Path) -> None:
-        for post_render in self._get_metadata(LightWait.POSTS_METADATA_NAME):
+    def _generate_assets(self, stage_path: Path, manifest: BuildManifest) -> Dict[str, str]:
+        """
+        Copy static files from www, minifying css, and additionally writing
+        css and js under a name holding their content hash.
+        Files whose content is unchanged are not copied again
+
+        @return: www relative paths mapped to the path to link to
+        """
+        asset_paths = {}
+        for src in sorted(self.www.rglob("*")):
+            if not src.is_file():
+                continue
+            rel = src.relative_to(self.www).as_posix()
+            src_hash = manifest.file_hash(src)
+            targets = [rel]
+            if src.suffix in assets.FINGERPRINT_SUFFIXES:
+                targets.append(assets.fingerprint(rel, src_hash))
+            asset_paths[rel] = targets[-1]
+            digest = manifest.digest(src_hash)
+            outputs = [stage_path / target for target in targets]
+            if all(manifest.is_current(output, digest) for output in outputs):
+                continue
+            data = src.read_bytes()
+            if src.suffix == ".css":
+                data = assets.minify_css(data.decode('utf-8')).encode('utf-8')
+            for output in outputs:
+                output.parent.mkdir(parents=True, exist_ok=True)
+                output.write_bytes(data)
+                manifest.record(output, digest)
+            logging.info(f"Copied {rel}")
+        return asset_paths
+
+    def _publish(self, stage_path: Path, docroot: Path) -> Tuple[List[Path], List[Path]]:
+        return Publisher(self.base / LightWait.PUBLISH_RECORD, stage_path, docroot).publish()
+
+    def _compress_outputs(self, manifest: BuildManifest) -> None:
+        """write precompressed siblings of each text output, unless current"""
+        for output in manifest.touched_outputs():
+            if output.suffix not in assets.COMPRESS_SUFFIXES:
+                continue
+            digest = manifest.get(output)
+            siblings = assets.compressed_paths(output)
+            if all(manifest.is_current(sibling, digest) for sibling in siblings):
+                continue
+            for sibling in assets.compress(output):
+                manifest.record(sibling, digest)
+
+    def _generate_posts(self,
+                        stage_path: Path,
+                        posts: List[Dict[str, Any]],
+                        manifest: BuildManifest,
+                        jobs: int = 1,
+                        report: Optional[BuildReport] = None,
+                        images: Optional[Dict[str, Dict[str, Any]]] = None,
+                        related: Optional[Dict[str, List[str]]] = None) -> None:
+        render_digest = self._render_digest(manifest)
+        work = []
+        digests = {}
+        html_keys = set()
+        by_title = {p[LightWait.MD_TITLE]: p for p in posts}
+        for post_metadata in posts:
+            post_render = dict(post_metadata)
+            post_render[LightWait.MD_IMAGES] = {ref: images[name]
+                                                for ref, name in post_metadata.get(LightWait.MD_IMAGES, {}).items()
+                                                if images and name in images}
+            post_render["related"] = [{LightWait.MD_TITLE: title,
+                                       LightWait.MD_DESCRIPTION: by_title[title][LightWait.MD_DESCRIPTION]}
+                                      for title in (related or {}).get(post_render["title"], [])
+                                      if title in by_title]
             name = post_render["title"]
             post_dir = stage_path / self.CONTENT / name
-            post_dir.mkdir(parents=True, exist_ok=True)
             post_file = post_dir / "index.html"
-            # augment post with content from markdown
-            post_render['content'] = self._get_content(name)
-            self._render("post.index", post_file, post_render)
+            markdown_path = self.markdown / (name + '.md')
+            markdown_hash = manifest.file_hash(markdown_path)
+            html_key = self.converter.key(markdown_hash, post_render[LightWait.MD_IMAGES])
+            html_keys.add(html_key)
+            digest = manifest.digest(render_digest, markdown_hash, post_render)
+            if manifest.is_current(post_file, digest):
+                logging.info(f"Unchanged {name}")
+                continue
+            post_dir.mkdir(parents=True, exist_ok=True)
+            work.append((post_render, markdown_path, post_file, html_key))
+            digests[post_file] = digest
+        self.renderer.site = self._site_data()
+        from lightwait.render import render_posts
+        for (post_render, _, post_file, _), timings in render_posts(self.renderer, work, jobs):
+            manifest.record(post_file, digests[post_file])
+            if report is not None:
+                report.add_post(post_render["title"], timings)
+        # html of edited posts, or of posts since removed, is not used again
+        removed = self.converter.prune(html_keys)
+        if report is not None:
+            report.count("posts rendered", len(work))
+            report.count("html cache entries removed", removed)
+
+    def _generate_images(self,
+                         stage_path: Path,
+                         posts: List[Dict[str, Any]],
+                         manifest: BuildManifest,
+                         jobs: int = 1) -> Dict[str, Dict[str, Any]]:
+        """
+        Publish the images of posts with their resized variants, which are made
+        once per image and kept in the cache, on a pool of jobs threads.
+        Images already in the stage are not touched
+
+        @return: media names mapped to how posts show them, see ImageTreeprocessor
+        """
+        names = sorted({name for p in posts for name in p.get(LightWait.MD_IMAGES, {}).values()
+                        if (self.media / name).exists()})
+        if not names:
+            return {}
+        from lightwait import images
+        processor = images.ImageProcessor(self.media,
+                                          self.base / LightWait.CACHE,
+                                          images.parse_widths(self.config.get('lw', 'imageWidths', fallback='')),
+                                          self.config.getboolean('lw', 'imageWebp', fallback=False),
+                                          self.config.getint('lw', 'imageQuality', fallback=80))
+        media_stage = stage_path / LightWait.MEDIA
+        media_stage.mkdir(exist_ok=True)
+        rendered = {}
+        for name, info in processor.info_all(names, jobs).items():
+            sources = {name: self.media / name}
+            for variants in info["variants"].values():
+                sources.update({file: processor.cache_path / file for _, file in variants})
+            # media are named by content, so only the settings can change them
+            digest = manifest.digest(processor.settings)
+            for file, src in sources.items():
+                output = media_stage / file
+                if not manifest.is_current(output, digest):
+                    copy2(src.as_posix(), output.as_posix())
+                    manifest.record(output, digest)
+            rendered[name] = images.render_info(name, info, f"/{LightWait.MEDIA}")
+        return rendered
+
+    def _related_posts(self, posts: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        related = RelatedPosts(self.base / LightWait.CACHE, self.config.getint('lw', 'relatedPosts', fallback=0))
+        computed = related.compute(posts)
+        related.save()
+        return computed
+
+    def _generate_sitemap(self, stage_path: Path, posts: List[Dict[str, Any]], manifest: BuildManifest) -> None:
+        """
+        Write sitemap.xml, an index of sitemap-N.xml files listing every page with the
+        time its content last changed. Posts are listed oldest first, then the index
+        pages, so adding posts or tags only changes the last sitemap files, and only
+        changed files are written
+        """
+        size = min(self.config.getint('lw', 'sitemapSize', fallback=sitemap.MAX_URLS), sitemap.MAX_URLS)
+        indexes = sorted(k for k in manifest.touched
+                         if k == "index.html" or k.startswith(LightWait.PAGE + "/") or k.startswith(LightWait.TAG))
+        keys = [f"{LightWait.CONTENT}/{p[LightWait.MD_TITLE]}/index.html" for p in reversed(posts)] + indexes
+        urls = [(self.URL + sitemap.page_url(k), manifest.modified.get(k)) for k in keys]
+        shards = [urls[i:i + size] for i in range(0, len(urls), size)] or [[]]
+        files = {}
+        entries = []
+        for n, shard in enumerate(shards, 1):
+            name = f"sitemap-{n}.xml"
+            files[name] = sitemap.sitemap_xml(shard)
+            lastmods = [lastmod for _, lastmod in shard if lastmod is not None]
+            entries.append((self.URL + name, max(lastmods) if lastmods else None))
+        files["sitemap.xml"] = sitemap.sitemap_index_xml(entries)
+        for name, xml in files.items():
+            output = stage_path / name
+            digest = manifest.digest(xml)
+            if manifest.is_current(output, digest):
+                continue
+            output.write_text(xml)
+            manifest.record(output, digest)
             logging.info(f"Generated {name}")
 
-    def _generate_indexes(self, stage_path: Path) -> None:
-        posts = self._get_metadata(LightWait.POSTS_METADATA_NAME)
-        tags = self._get_all_tags(posts)
+    def _generate_indexes(self, stage_path: Path, posts: List[Dict[str, Any]], manifest: BuildManifest) -> None:
+        tags = sorted(self._get_all_tags(posts))
+        render_digest = self._render_digest(manifest)
 
         index_render_data = {
             "tags": tags,
-            "posts": posts,
             "blogtitle": self.config.get('lw', 'blogTitle'),
             "blogsubtitle": self.config.get('lw', 'blogSubTitle'),
             "tagline": self.config.get('lw', 'blogTagLine')
         }
-        main_path = stage_path / "index.html"
-        self._render("main.index", main_path, index_render_data)
-        logging.info("Generated index.html")
+        self._generate_pages(stage_path, "main.index", "", lambda n: f"{LightWait.PAGE}/{n}/",
+                             posts, index_render_data, render_digest, manifest)
 
         for tag in tags:
-            filename = self.TAG + tag + ".html"
-            tag_posts = self._get_metadata(tag)
             tag_render_data = {
-                "tag": tag,
-                "posts": tag_posts
+                "tag": tag
             }
-            tag_path = stage_path / filename
-            self._render("tag.index", tag_path, tag_render_data)
-            logging.info(f"Generated {tag} index")
+            self._generate_pages(stage_path, "tag.index",
+                                 self.TAG + tag + ".html", lambda n: f"{self.TAG}{tag}/{LightWait.PAGE}/{n}.html",
+                                 self.store.tag_posts(tag), tag_render_data, render_digest, manifest)
 
-    def _generate_rss(self, stage_path: Path) -> None:
-        feed = self._create_feed()
-        for post_metadata in reversed(self._get_metadata(LightWait.POSTS_METADATA_NAME)):
+    def _generate_search(self, stage_path: Path, posts: List[Dict[str, Any]], manifest: BuildManifest) -> None:
+        """
+        Write a client side search index: a list of posts, oldest first so the id of
+        a post stays the same as newer posts are added, split into files by id range,
+        and an inverted index of terms to post ids, split into one small file per term prefix.
+        Ids are positions in date order, so a post dated before others changes the ids,
+        and so the index files, of every newer post.
+        Only posts whose markdown or metadata changed are tokenized again, and only
+        index files whose content changed are written
+        """
+        term_cache = TermCache(self.base / LightWait.CACHE)
+        docs = []
+        doc_terms = []
+        for post_metadata in reversed(posts):
+            name = post_metadata[LightWait.MD_TITLE]
+            markdown_path = self.markdown / (name + '.md')
+            doc_terms.append(term_cache.terms(post_metadata, markdown_path, manifest.file_hash(markdown_path)))
+            docs.append([f"/{self.CONTENT}/{name}/", post_metadata[LightWait.MD_DESCRIPTION],
+                         post_metadata[LightWait.MD_DATE]])
+        term_cache.save()
+
+        search_path = stage_path / LightWait.SEARCH
+        search_path.mkdir(exist_ok=True)
+        files = {"settings.json": search_settings()}
+        files.update({f"{key}.json": shard for key, shard in doc_shards(docs).items()})
+        files.update({f"{key}.json": postings for key, postings in build_shards(doc_terms).items()})
+        for name, data in files.items():
+            output = search_path / name
+            digest = manifest.digest(data)
+            if manifest.is_current(output, digest):
+                continue
+            output.write_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+            manifest.record(output, digest)
+            logging.info(f"Generated {LightWait.SEARCH}/{name}")
+
+    def _generate_pages(self,
+                        stage_path: Path,
+                        template_name: str,
+                        first_path: str,
+                        page_path: Callable[[int], str],
+                        posts: List[Dict[str, Any]],
+                        data: Dict[str, Any],
+                        render_digest: str,
+                        manifest: BuildManifest) -> None:
+        """
+        Render a paginated list of posts. The newest posts are on the first page,
+        older posts are on archive pages numbered from the oldest, so an archive
+        page keeps its path and content as new posts are added.
+        Paths are relative to the site root, ending in '/' for a directory index
+        """
+        first, archive = LightWait._paginate(posts, self.config.getint('lw', 'pageSize', fallback=0))
+        # newest to oldest
+        pages = [(first_path, first)] + [(page_path(n), archive[n - 1]) for n in range(len(archive), 0, -1)]
+        for i, (path, page_posts) in enumerate(pages):
+            newer = "/" + pages[i - 1][0] if i > 0 else None
+            older = "/" + pages[i + 1][0] if i + 1 < len(pages) else None
+            outfile = stage_path / (path + "index.html" if path == "" or path.endswith("/") else path)
+            digest = manifest.digest(render_digest, template_name, data, path, page_posts, newer, older)
+            if manifest.is_current(outfile, digest):
+                continue
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            render_data = dict(data, posts=page_posts, page_path=path, prev=newer, next=older)
+            self._render(template_name, outfile, render_data)
+            manifest.record(outfile, digest)
+            logging.info(f"Generated {outfile.relative_to(stage_path).as_posix()}")
+
+    @staticmethod
+    def _paginate(posts: List[Dict[str, Any]],
+                  page_size: int) -> Tuple[List[Dict[str, Any]], List[List[Dict[str, Any]]]]:
+        """
+        Split posts, newest first, into the first page and archive pages.
+        Archive page n holds the n-th oldest page_size posts, and the first page
+        holds the rest: between page_size and 2 * page_size - 1 posts
+        """
+        if page_size <= 0:
+            return posts, []
+        archived = max(0, len(posts) // page_size - 1)
+        end = len(posts)
+        archive = [posts[end - n * page_size:end - (n - 1) * page_size] for n in range(1, archived + 1)]
+        return posts[:end - archived * page_size], archive
+
+    def _generate_rss(self, stage_path: Path, posts: List[Dict[str, Any]], manifest: BuildManifest) -> None:
+        self._generate_feed(stage_path, posts, None, manifest)
+        if self.config.getboolean('lw', 'feedTags', fallback=False):
+            for tag in sorted(self._get_all_tags(posts)):
+                self._generate_feed(stage_path, self.store.tag_posts(tag), tag, manifest)
+
+    def _generate_feed(self,
+                       stage_path: Path,
+                       posts: List[Dict[str, Any]],
+                       tag: Optional[str],
+                       manifest: BuildManifest) -> None:
+        """
+        Write the RSS feed, and optionally the Atom feed, of the newest posts,
+        for all posts or for the posts of one tag. Feeds are only written
+        when the metadata of the posts they hold has changed
+        """
+        feed_size = self.config.getint('lw', 'feedSize', fallback=0)
+        entries = posts[:feed_size] if feed_size > 0 else posts
+        suffix = "" if tag is None else "-" + tag
+        feed_paths = [stage_path / self.CONTENT / f"rss{suffix}.xml"]
+        if self.config.getboolean('lw', 'feedAtom', fallback=False):
+            feed_paths.append(stage_path / self.CONTENT / f"atom{suffix}.xml")
+        digest = manifest.digest(self._config_digest(), tag, entries)
+        if all(manifest.is_current(feed_path, digest) for feed_path in feed_paths):
+            return
+
+        feed = self._create_feed(tag)
+        if entries:
+            # the newest post rather than the time of building, so unchanged feeds are identical
+            feed.updated(entries[0][LightWait.MD_DATE] + " 00:00:00 GMT")
+            feed.lastBuildDate(entries[0][LightWait.MD_DATE] + " 00:00:00 GMT")
+        for post_metadata in reversed(entries):
             fe = feed.add_entry()
             fe.id(self.URL + "content/" + post_metadata[LightWait.MD_TITLE])
             fe.title(post_metadata[LightWait.MD_TITLE])
@@ -346,55 +887,107 @@ class LightWait(object):
             fe.category(terms)
             fe.link(href=self.URL + "content/" + post_metadata[LightWait.MD_TITLE], rel="alternate")
             fe.published(post_metadata[LightWait.MD_DATE] + " 00:00:00 GMT")
-        rss_path = stage_path / self.CONTENT / "rss.xml"
-        feed.rss_file(rss_path.as_posix(), pretty=True)
-        logging.info("Generated RSS")
-
-    def _create_feed(self) -> FeedGenerator:
+            fe.updated(post_metadata[LightWait.MD_DATE] + " 00:00:00 GMT")
+        feed_paths[0].parent.mkdir(parents=True, exist_ok=True)
+        for feed_path in feed_paths:
+            feed.link([{"href": self.URL, "rel": "alternate"},
+                       {"href": self.URL + "content/" + feed_path.name, "rel": "self"}],
+                      replace=True)
+            if feed_path.name.startswith("atom"):
+                feed.atom_file(feed_path.as_posix())
+            else:
+                feed.rss_file(feed_path.as_posix())
+            manifest.record(feed_path, digest)
+            logging.info(f"Generated {feed_path.name}")
+
+    def _config_digest(self) -> str:
+        items = [(k, v) for k, v in self.config.items('lw') if k not in LightWait.NON_CONTENT_KEYS]
+        return BuildManifest.digest(items)
+
+    def _render_digest(self, manifest: BuildManifest) -> str:
+        """digest of everything shared by rendered pages: config and every template"""
+        templates = {t.relative_to(self.template).as_posix(): manifest.file_hash(t)
+                     for t in sorted(self.template.rglob("*")) if t.is_file()}
+        return manifest.digest(self._config_digest(), templates, self.assets)
+
+    def _create_feed(self, tag: Optional[str] = None) -> 'FeedGenerator':
+        from feedgen.feed import FeedGenerator
         fg = FeedGenerator()
-        fg.id(self.URL + "content")
-        fg.title(self.config.get('lw', 'blogTitle'))
+        if tag is None:
+            fg.id(self.URL + "content")
+            fg.title(self.config.get('lw', 'blogTitle'))
+        else:
+            fg.id(self.URL + self.TAG + tag + ".html")
+            fg.title(self.config.get('lw', 'blogTitle') + " - " + tag)
         fg.author({"name": self.config.get('lw', 'blogAuthor'), "email": self.config.get('lw', 'blogAuthorEmail')})
-        fg.link(href=self.URL, rel="alternate")
         fg.logo(self.URL + "image/favicon.ico")
         fg.subtitle(self.config.get('lw', 'blogSubTitle'))
-        fg.link(href=self.URL + "content/rss.xml", rel="self")
         fg.language(self.config.get('lw', 'blogLang'))
         return fg
 
-    def _generate_output(self, out_path: Path) -> None:
-        for post_metadata in self._get_metadata(LightWait.POSTS_METADATA_NAME):
-            markdown_doc = []
-            for key in LightWait.ALL_KEYS:
-                markdown_doc.append(
-                    LightWait._gen_comment_metadata(key, post_metadata[key])
-                )
+    def _generate_output(self, out_path: Path, jobs: int = 1) -> List[Path]:
+        files = []
+        for post_metadata in self.store.posts():
             markdown_name = post_metadata[LightWait.MD_TITLE] + '.md'
             markdown_path = self.markdown / markdown_name
-            out_full_path = out_path / markdown_name
             if markdown_path.exists():
-                with open(markdown_path.as_posix(), 'r') as lines:
-                    rs = list(dropwhile(lambda x: x.startswith(LightWait.MD_PREFIX), lines))
-                markdown_doc.extend(rs)
-                with open(out_full_path, 'w') as outfile:
-                    outfile.write(''.join(markdown_doc))
-
-    def _get_content(self, name: str) -> str:
-        markdown_name = name + '.md'
-        markdown_path = self.markdown / markdown_name
-        text = markdown_path.read_text()
-        return markdown.markdown(text)
+                header = ''.join(LightWait._gen_comment_metadata(key, post_metadata[key]) for key in LightWait.ALL_KEYS)
+                files.append(ExportFile(markdown_name, header, markdown_path, LightWait.MD_PREFIX))
+        if archive_mode(out_path) is not None:
+            export_to_archive(files, out_path)
+            logging.info(f"Exported {len(files)} posts to {out_path.as_posix()}")
+            return [out_path]
+        written, skipped = export_to_dir(files, out_path, jobs)
+        logging.info(f"Exported {len(written)} posts to {out_path.as_posix()}, {len(skipped)} unchanged")
+        return written
+
+    def _site_data(self) -> Dict[str, str]:
+        """render data common to every page"""
+        return {
+            'url': self.URL,
+            'lang': self.config.get('lw', 'blogLang'),
+            'copyright': self.config.get('lw', 'copyright'),
+            'assets': self.assets,
+            'search': self.config.getboolean('lw', 'searchIndex', fallback=False)
+        }
 
     def _render(self, template_name: str, outfile: Path, data: Dict[str, Any]) -> None:
-        data['url'] = self.URL
-        data['lang'] = self.config.get('lw', 'blogLang')
-        data['copyright'] = self.config.get('lw', 'copyright')
+        data.update(self._site_data())
 
         template = self._get_template(template_name)
         output = template.render(j=data)
         outfile.write_text(output)
 
+    @cached_property
+    def env(self) -> 'Environment':
+        """jinja Environment kept for the life of this instance"""
+        from lightwait.render import create_environment
+        return create_environment(self.template, self.base / LightWait.CACHE)
+
+    @cached_property
+    def converter(self) -> 'MarkdownConverter':
+        """markdown converter kept for the life of this instance"""
+        from lightwait.render import MarkdownConverter
+        return MarkdownConverter(self._markdown_extensions(), self.base / LightWait.CACHE)
+
+    @cached_property
+    def renderer(self) -> 'PostRenderer':
+        from lightwait.render import PostRenderer
+        return PostRenderer(self.template,
+                            self.base / LightWait.CACHE,
+                            self._site_data(),
+                            self._markdown_extensions(),
+                            self.env,
+                            self.converter)
+
+    def _markdown_extensions(self) -> List[str]:
+        extensions = self.config.get('lw', 'markdownExtensions', fallback='')
+        return [e.strip() for e in extensions.split(",") if e.strip()]
+
+    def _precompile_templates(self) -> None:
+        """compile every template up front, loading bytecode where it is current"""
+        for name in self.env.list_templates(filter_func=lambda n: n.endswith(LightWait.TEMPLATE_SUFFIX)):
+            self.env.get_template(name)
+
     def _get_template(self, template_name: str):
-        file_loader = FileSystemLoader(self.template)
-        env = Environment(loader=file_loader)
-        return env.get_template(template_name)
+        return self.env.get_template(template_name)
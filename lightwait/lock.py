@@ -0,0 +1,28 @@
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def locked(path: Path, shared: bool = False) -> Iterator[None]:
+    """
+    Hold an advisory lock on the given lock file: shared among readers,
+    or exclusive for a writer. Locks are released when the holder exits,
+    even if it is killed. Where fcntl is not available, nothing is locked
+    """
+    if fcntl is None:
+        logging.info(f"No file locking available, not locking {path.as_posix()}")
+        yield
+        return
+    with path.open("a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
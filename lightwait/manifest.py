@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+
+class BuildManifest(object):
+    """
+    Persistent record of the inputs used to produce each generated file
+
+    Each output is stored with a digest of everything it was rendered from,
+    so a later generate can skip any output whose inputs are unchanged.
+    Source file hashes are cached by modification time and size so unchanged
+    markdown is not re-read just to prove it is unchanged.
+    Outputs neither checked nor written by a generate are stale, and are
+    removed by prune(). The time each output's inputs last changed is kept
+    too, for the lastmod of sitemaps
+    """
+    VERSION = 1
+
+    def __init__(self, path: Path, stage_path: Path):
+        self.path = path
+        self.stage_path = stage_path
+        # source path -> [mtime_ns, size, sha256]
+        self.sources: Dict[str, List[Any]] = {}
+        # output path relative to stage -> input digest
+        self.outputs: Dict[str, str] = {}
+        # output path relative to stage -> time its digest last changed
+        self.modified: Dict[str, str] = {}
+        # outputs forgotten by clear(), so a full rebuild keeps the modified time of unchanged outputs
+        self._cleared: Dict[str, str] = {}
+        # outputs checked or written since loading
+        self.touched: Set[str] = set()
+        self._used_sources: Set[str] = set()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with self.path.open() as json_file:
+                data = json.load(json_file)
+        except ValueError:
+            logging.info(f"Ignoring unreadable manifest: {self.path.as_posix()}")
+            return
+        if data.get("version") != BuildManifest.VERSION:
+            return
+        self.sources = data.get("sources", {})
+        # outputs are only meaningful for the stage they were written to
+        if data.get("stage") == self.stage_path.as_posix():
+            self.outputs = data.get("outputs", {})
+            self.modified = data.get("modified", {})
+
+    def clear(self) -> None:
+        """forget all outputs, forcing a full rebuild"""
+        self._cleared = self.outputs
+        self.outputs = {}
+
+    def save(self) -> None:
+        data = {
+            "version": BuildManifest.VERSION,
+            "stage": self.stage_path.as_posix(),
+            "sources": self.sources,
+            "outputs": self.outputs,
+            "modified": self.modified
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as outfile:
+            json.dump(data, outfile)
+        tmp_path.replace(self.path)
+
+    def file_hash(self, src_path: Path) -> str:
+        """content hash of a source file, re-read only when its stat changes"""
+        key = src_path.as_posix()
+        self._used_sources.add(key)
+        stat = src_path.stat()
+        cached = self.sources.get(key)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        sha = hashlib.sha256(src_path.read_bytes()).hexdigest()
+        self.sources[key] = [stat.st_mtime_ns, stat.st_size, sha]
+        return sha
+
+    @staticmethod
+    def digest(*parts: Any) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def is_current(self, output: Path, digest: str) -> bool:
+        key = self._key(output)
+        if self.outputs.get(key) == digest and output.exists():
+            self.touched.add(key)
+            return True
+        return False
+
+    def record(self, output: Path, digest: str) -> None:
+        key = self._key(output)
+        if self.outputs.get(key, self._cleared.get(key)) != digest or key not in self.modified:
+            self.modified[key] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.outputs[key] = digest
+        self.touched.add(key)
+
+    def get(self, output: Path) -> Optional[str]:
+        return self.outputs.get(self._key(output))
+
+    def touched_outputs(self) -> List[Path]:
+        return [self.stage_path / key for key in sorted(self.touched)]
+
+    def prune(self) -> List[Path]:
+        """
+        Delete stale outputs, which were produced by an earlier generate
+        but not by this one, along with directories left empty
+
+        @return: deleted outputs
+        """
+        stale = [key for key in self.outputs if key not in self.touched]
+        removed = []
+        for key in stale:
+            del self.outputs[key]
+            self.modified.pop(key, None)
+            output = self.stage_path / key
+            if output.exists():
+                output.unlink()
+                removed.append(output)
+            remove_empty_dirs(output.parent, self.stage_path)
+        self.sources = {k: v for k, v in self.sources.items() if k in self._used_sources}
+        return removed
+
+    def _key(self, output: Path) -> str:
+        return output.relative_to(self.stage_path).as_posix()
+
+
+def remove_empty_dirs(path: Path, root: Path) -> None:
+    """remove path and its parents while they are empty, stopping at root"""
+    while path != root and root in path.parents:
+        try:
+            path.rmdir()
+        except OSError:
+            return
+        path = path.parent
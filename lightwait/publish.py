@@ -0,0 +1,91 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from shutil import copy2
+from typing import Any, Dict, List, Tuple
+from lightwait.manifest import remove_empty_dirs
+
+# published last, so pages never link to assets which are not yet published
+PAGE_SUFFIXES = (".html", ".xml")
+
+
+class Publisher(object):
+    """
+    Publishes a staged site into a docroot
+
+    Only files whose bytes differ from what was last published are copied,
+    each to a temporary file which then replaces the target in one step,
+    so a web server never serves a partly written file. Files published
+    earlier which are no longer staged are removed. Files in the docroot
+    which were never published are left alone
+    """
+
+    def __init__(self, record_path: Path, stage_path: Path, docroot: Path):
+        self.record_path = record_path
+        self.stage_path = stage_path
+        self.docroot = docroot
+        self.records: Dict[str, Dict[str, List[Any]]] = {}
+        if record_path.exists():
+            with record_path.open() as json_file:
+                self.records = json.load(json_file)
+
+    def publish(self) -> Tuple[List[Path], List[Path]]:
+        """
+        @return: the docroot files copied and the docroot files removed
+        """
+        previous = self.records.get(self.docroot.as_posix(), {})
+        current: Dict[str, List[Any]] = {}
+        copied = []
+        staged = sorted((p for p in self.stage_path.rglob("*") if p.is_file()),
+                        key=lambda p: (p.suffix in PAGE_SUFFIXES, p.name == "index.html", p.as_posix()))
+        for src in staged:
+            rel = src.relative_to(self.stage_path).as_posix()
+            stat = src.stat()
+            record = previous.get(rel)
+            if record is not None and record[0] == stat.st_mtime_ns and record[1] == stat.st_size:
+                sha = record[2]
+            else:
+                sha = Publisher._hash(src)
+            current[rel] = [stat.st_mtime_ns, stat.st_size, sha]
+            target = self.docroot / rel
+            if target.exists():
+                if record is not None and record[2] == sha:
+                    continue
+                # not published by us before, but possibly identical
+                if record is None and target.stat().st_size == stat.st_size and Publisher._hash(target) == sha:
+                    continue
+            Publisher._replace(src, target)
+            copied.append(target)
+
+        removed = []
+        for rel in previous.keys() - current.keys():
+            target = self.docroot / rel
+            if target.exists():
+                target.unlink()
+                removed.append(target)
+            remove_empty_dirs(target.parent, self.docroot)
+
+        self.records[self.docroot.as_posix()] = current
+        tmp_path = self.record_path.with_suffix(".tmp")
+        with tmp_path.open("w") as outfile:
+            json.dump(self.records, outfile)
+        tmp_path.replace(self.record_path)
+        logging.info(f"Published {len(copied)} files, removed {len(removed)} from {self.docroot.as_posix()}")
+        return copied, removed
+
+    @staticmethod
+    def _replace(src: Path, target: Path) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        copy2(src.as_posix(), tmp_path.as_posix())
+        os.replace(tmp_path, target)
+
+    @staticmethod
+    def _hash(path: Path) -> str:
+        h = hashlib.sha256()
+        with path.open("rb") as infile:
+            for chunk in iter(lambda: infile.read(1 << 16), b""):
+                h.update(chunk)
+        return h.hexdigest()
@@ -0,0 +1,130 @@
+import heapq
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+# neighbours either side of a post, in date order, considered within each of its tags
+WINDOW = 50
+
+
+def tag_index(posts: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """tag -> titles of its posts, in the order of posts"""
+    index: Dict[str, List[str]] = {}
+    for p in posts:
+        for tag in dict.fromkeys(p["tags"]):
+            index.setdefault(tag, []).append(p["title"])
+    return index
+
+
+class RelatedPosts(object):
+    """
+    The posts most related to each post, by the tags they share
+
+    Candidates come from an inverted tag index rather than comparing every
+    pair of posts: within each of its tags a post is compared with at most
+    WINDOW posts either side of it in date order. A shared tag counts for
+    more the fewer posts have it, and ties go to the post nearest in date.
+    Lists are cached, and only recomputed for posts near a post whose tags
+    or date changed, or which was added or removed, in one of its tags,
+    and for posts whose list names such a post.
+    The weight of a tag is taken as of when each list was computed
+    """
+    VERSION = 1
+    CACHE_NAME = "related.json"
+
+    def __init__(self, cache_path: Path, limit: int, window: int = WINDOW):
+        self.path = cache_path / RelatedPosts.CACHE_NAME
+        self.limit = limit
+        self.window = window
+        # title -> [tags, date] the lists were computed from
+        self.posts: Dict[str, List[Any]] = {}
+        # title -> titles of related posts
+        self.related: Dict[str, List[str]] = {}
+        if self.path.exists():
+            try:
+                with self.path.open() as json_file:
+                    data = json.load(json_file)
+                if data.get("version") == RelatedPosts.VERSION and data.get("settings") == [limit, window]:
+                    self.posts = data["posts"]
+                    self.related = data["related"]
+            except (ValueError, KeyError):
+                logging.info(f"Ignoring unreadable related posts cache: {self.path.as_posix()}")
+
+    def compute(self, posts: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """
+        @param posts: all posts, newest first
+        @return: title of each post mapped to the titles of its related posts, most related first
+        """
+        current = {p["title"]: [p["tags"], p["date"]] for p in posts}
+        index = tag_index(posts)
+        dirty = self._dirty(current, index)
+        if dirty:
+            rank = {p["title"]: i for i, p in enumerate(posts)}
+            positions = {tag: {title: i for i, title in enumerate(titles)} for tag, titles in index.items()}
+            for title in dirty:
+                self.related[title] = self._compute_one(title, current[title][0], index, positions, rank)
+            logging.info(f"Computed related posts of {len(dirty)} posts")
+        self.related = {title: self.related[title] for title in current}
+        self.posts = current
+        return self.related
+
+    def save(self) -> None:
+        data = {
+            "version": RelatedPosts.VERSION,
+            "settings": [self.limit, self.window],
+            "posts": self.posts,
+            "related": self.related
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as outfile:
+            json.dump(data, outfile)
+        tmp_path.replace(self.path)
+
+    def _dirty(self, current: Dict[str, List[Any]], index: Dict[str, List[str]]) -> Set[str]:
+        """posts whose related list may differ from the cached one"""
+        if not self.posts:
+            return set(current)
+        dirty = {t for t in current if t not in self.related}
+        changed = {t for t in current.keys() | self.posts.keys() if current.get(t) != self.posts.get(t)}
+        if changed:
+            # cached posts are kept newest first, as they were given
+            old_index = tag_index([{"title": t, "tags": v[0]} for t, v in self.posts.items()])
+            for tags_index in (index, old_index):
+                positions: Dict[str, Dict[str, int]] = {}
+                for title in changed:
+                    for tag in set(current.get(title, [[]])[0]) | set(self.posts.get(title, [[]])[0]):
+                        titles = tags_index.get(tag)
+                        if not titles:
+                            continue
+                        if tag not in positions:
+                            positions[tag] = {t: i for i, t in enumerate(titles)}
+                        i = positions[tag].get(title)
+                        if i is not None:
+                            dirty.update(titles[max(0, i - self.window):i + self.window + 1])
+            # posts move within a date without changing, so a list may name a changed post
+            # no longer near it in any tag
+            dirty.update(t for t, related in self.related.items() if not changed.isdisjoint(related))
+        return {t for t in dirty if t in current}
+
+    def _compute_one(self,
+                     title: str,
+                     tags: List[str],
+                     index: Dict[str, List[str]],
+                     positions: Dict[str, Dict[str, int]],
+                     rank: Dict[str, int]) -> List[str]:
+        if self.limit <= 0:
+            return []
+        scores: Dict[str, float] = {}
+        for tag in dict.fromkeys(tags):
+            titles = index[tag]
+            weight = 1 / math.log2(1 + len(titles))
+            i = positions[tag][title]
+            for other in titles[max(0, i - self.window):i + self.window + 1]:
+                if other != title:
+                    scores[other] = scores.get(other, 0.0) + weight
+        own = rank[title]
+        return [other for _, _, other in heapq.nsmallest(
+            self.limit, ((-score, abs(rank[other] - own), other) for other, score in scores.items()))]
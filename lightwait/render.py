@@ -0,0 +1,260 @@
+import hashlib
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from xml.etree import ElementTree
+from lightwait.exception import LightwaitException
+
+# post metadata to render, markdown source, html output, html cache key
+PostJob = Tuple[Dict[str, Any], Path, Path, Optional[str]]
+
+# directories under the cache path
+TEMPLATE_CACHE = "jinja"
+HTML_CACHE = "html"
+
+# renderer owned by each worker process
+_worker_renderer = None
+# images are shown at most as wide as the main column of the stylesheet
+IMAGE_SIZES = "(max-width: 40em) 100vw, 40em"
+
+
+def create_environment(template_path: Path, cache_path: Path) -> Environment:
+    """
+    Jinja Environment whose compiled templates are also kept as bytecode
+    under cache_path, so other processes and later runs skip compilation.
+    Templates are reloaded only when their source file changes
+    """
+    bytecode_path = cache_path / TEMPLATE_CACHE
+    bytecode_path.mkdir(parents=True, exist_ok=True)
+    return Environment(loader=FileSystemLoader(template_path),
+                       bytecode_cache=FileSystemBytecodeCache(bytecode_path.as_posix()),
+                       auto_reload=True)
+
+
+class ImageTreeprocessor(Treeprocessor):
+    """
+    Points images collected from the post at their published copy, with dimensions,
+    lazy loading, a srcset of resized variants, and a webp source where one exists
+    """
+
+    def run(self, root):
+        images = getattr(self.md, "lw_images", None)
+        if not images:
+            return
+        for parent in list(root.iter()):
+            for index, child in enumerate(list(parent)):
+                image = images.get(child.get("src")) if child.tag == "img" else None
+                if image is None:
+                    continue
+                child.set("src", image["src"])
+                if image["width"] is not None:
+                    child.set("width", str(image["width"]))
+                    child.set("height", str(image["height"]))
+                child.set("loading", "lazy")
+                child.set("decoding", "async")
+                if image["srcset"]:
+                    child.set("srcset", ImageTreeprocessor._srcset(image["srcset"]))
+                    child.set("sizes", IMAGE_SIZES)
+                if image["webp"]:
+                    picture = ElementTree.Element("picture")
+                    ElementTree.SubElement(picture, "source", {"type": "image/webp",
+                                                               "srcset": ImageTreeprocessor._srcset(image["webp"]),
+                                                               "sizes": IMAGE_SIZES})
+                    picture.tail, child.tail = child.tail, None
+                    parent.remove(child)
+                    picture.append(child)
+                    parent.insert(index, picture)
+
+    @staticmethod
+    def _srcset(candidates: List[List[Any]]) -> str:
+        return ", ".join(f"{path} {width}w" for width, path in candidates)
+
+
+class ImageExtension(Extension):
+
+    def extendMarkdown(self, md):
+        md.lw_images = {}
+        # after inline patterns have created the img elements
+        md.treeprocessors.register(ImageTreeprocessor(md), "lw_images", 5)
+
+
+class MarkdownConverter(object):
+    """
+    Converts markdown to html with one Markdown instance, reset between
+    documents. Converted html is cached on disk, keyed by a hash of the
+    markdown and of the extension configuration, so unchanged markdown
+    is never parsed twice. Entries no generate uses any more are
+    removed by prune()
+    """
+
+    def __init__(self, extensions: List[str], cache_path: Path):
+        self.extensions = extensions
+        self.cache_path = cache_path / HTML_CACHE
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        try:
+            self.md = markdown.Markdown(extensions=extensions + [ImageExtension()])
+        except (ImportError, AttributeError) as e:
+            raise LightwaitException(f"Unable to load markdown extensions {extensions}: {e}")
+        self.config_digest = hashlib.sha256(
+            json.dumps([markdown.__version__, extensions]).encode('utf-8')).hexdigest()
+
+    def key(self, markdown_hash: str, images: Optional[Dict[str, Any]] = None) -> str:
+        """
+        cache key of html converted from markdown with the given sha256
+
+        @param images: image targets in the markdown mapped to how to write them, see ImageTreeprocessor
+        """
+        parts = [self.config_digest, markdown_hash, images or {}]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def convert(self, text: str, images: Optional[Dict[str, Any]] = None, key: Optional[str] = None) -> str:
+        """
+        @param images: image targets in the markdown mapped to how to write them, see ImageTreeprocessor
+        @param key: cache key from key(), if already known, otherwise taken from the text
+        """
+        images = images or {}
+        if key is None:
+            key = self.key(hashlib.sha256(text.encode('utf-8')).hexdigest(), images)
+        cached = self.cache_path / key[:2] / (key + ".html")
+        if cached.exists():
+            return cached.read_text()
+        self.md.reset()
+        self.md.lw_images = images
+        html = self.md.convert(text)
+        # other processes may write the same entry, so replace in one step
+        cached.parent.mkdir(exist_ok=True)
+        tmp_path = cached.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(html)
+        tmp_path.replace(cached)
+        return html
+
+    def prune(self, keys: Set[str]) -> int:
+        """
+        Delete cached html other than the given keys, such as html of edited markdown
+
+        @return: number of entries deleted
+        """
+        removed = 0
+        for cached in self.cache_path.glob("*/*.html"):
+            if cached.stem not in keys:
+                cached.unlink()
+                removed += 1
+        for shard in self.cache_path.iterdir():
+            if shard.is_dir() and not any(shard.iterdir()):
+                shard.rmdir()
+        return removed
+
+
+class PostRenderer(object):
+    """
+    Converts the markdown of a post and renders it with the post template
+
+    Holds a jinja Environment and markdown converter, so one renderer
+    is created per process and reused for every post it renders
+    """
+    TEMPLATE = "post.index"
+
+    def __init__(self,
+                 template_path: Path,
+                 cache_path: Path,
+                 site: Dict[str, str],
+                 extensions: List[str],
+                 env: Optional[Environment] = None,
+                 converter: Optional[MarkdownConverter] = None):
+        self.template_path = template_path
+        self.cache_path = cache_path
+        self.site = site
+        self.extensions = extensions
+        self.env = create_environment(template_path, cache_path) if env is None else env
+        self.converter = MarkdownConverter(extensions, cache_path) if converter is None else converter
+
+    def render_post(self,
+                    data: Dict[str, Any],
+                    markdown_path: Path,
+                    outfile: Path,
+                    html_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        @param html_key: cache key of the converted markdown, see MarkdownConverter.key()
+        @return: start time, process id and seconds taken to convert, render and write the post
+        """
+        name = data["title"]
+        timings: Dict[str, Any] = {"start": time.time(), "pid": os.getpid()}
+        try:
+            counter = time.perf_counter()
+            # augment post with content from markdown
+            data['content'] = self.converter.convert(markdown_path.read_text(), data.get("images"), html_key)
+            timings["convert"] = time.perf_counter() - counter
+            data.update(self.site)
+            counter = time.perf_counter()
+            output = self.env.get_template(PostRenderer.TEMPLATE).render(j=data)
+            timings["render"] = time.perf_counter() - counter
+            counter = time.perf_counter()
+            outfile.write_text(output)
+            timings["write"] = time.perf_counter() - counter
+        except Exception as e:
+            raise LightwaitException(f"Failed to generate {name}: {e}") from e
+        logging.info(f"Generated {name}")
+        return timings
+
+
+def render_posts(renderer: PostRenderer,
+                 jobs: List[PostJob],
+                 workers: int = 1) -> Iterator[Tuple[PostJob, Dict[str, Any]]]:
+    """
+    Render each post job, yielding jobs and their timings as their output is written.
+    With more than one worker, posts are spread over a process pool,
+    each worker with a renderer like the given one,
+    and worker log records are forwarded to the handlers of this process
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield job, renderer.render_post(*job)
+        return
+
+    workers = min(workers, len(jobs))
+    root = logging.getLogger()
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(renderer.template_path,
+                                           renderer.cache_path,
+                                           renderer.site,
+                                           renderer.extensions,
+                                           log_queue,
+                                           root.level)) as executor:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            yield from zip(jobs, executor.map(_render_job, jobs, chunksize=chunksize))
+    finally:
+        listener.stop()
+
+
+def _init_worker(template_path: Path,
+                 cache_path: Path,
+                 site: Dict[str, str],
+                 extensions: List[str],
+                 log_queue: multiprocessing.Queue,
+                 level: int) -> None:
+    global _worker_renderer
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    _worker_renderer = PostRenderer(template_path, cache_path, site, extensions)
+
+
+def _render_job(job: PostJob) -> Dict[str, Any]:
+    return _worker_renderer.render_post(*job)
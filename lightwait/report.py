@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+# phases of rendering one post
+POST_PHASES = ["convert", "render", "write"]
+
+
+class BuildReport(object):
+    """
+    Timing of a generate: each stage, and the markdown conversion,
+    template rendering and file write of each rendered post,
+    along with counts such as posts rendered and files published
+    """
+
+    def __init__(self):
+        # stage spans in the order they finished
+        self.spans: List[Dict[str, Any]] = []
+        # post title -> start, pid and seconds of each phase
+        self.posts: Dict[str, Dict[str, Any]] = {}
+        self.counts: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.time()
+        counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append({
+                "name": name,
+                "start": start,
+                "seconds": time.perf_counter() - counter,
+                "pid": os.getpid()
+            })
+
+    def add_post(self, title: str, timings: Dict[str, Any]) -> None:
+        self.posts[title] = timings
+
+    def count(self, name: str, value: int) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @property
+    def stages(self) -> Dict[str, float]:
+        """seconds spent in each stage"""
+        stages: Dict[str, float] = {}
+        for span in self.spans:
+            stages[span["name"]] = stages.get(span["name"], 0.0) + span["seconds"]
+        return stages
+
+    @property
+    def seconds(self) -> float:
+        return self.stages.get("generate", 0.0)
+
+    def post_phases(self) -> Dict[str, float]:
+        """seconds spent in each phase of rendering, summed over posts"""
+        return {phase: sum(t[phase] for t in self.posts.values()) for phase in POST_PHASES}
+
+    def slowest_posts(self, limit: int = 10) -> List[Tuple[str, Dict[str, Any]]]:
+        return sorted(self.posts.items(), key=lambda p: -sum(p[1][phase] for phase in POST_PHASES))[:limit]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "seconds": self.seconds,
+            "stages": self.stages,
+            "post_phases": self.post_phases(),
+            "counts": self.counts,
+            "posts": self.posts
+        }
+
+    def trace_events(self) -> Dict[str, Any]:
+        """stages and post phases in the chrome trace event format, as read by chrome://tracing or perfetto"""
+        events = []
+        for span in self.spans:
+            events.append(BuildReport._event(span["name"], "stage", span["start"], span["seconds"], span["pid"]))
+        for title, timings in self.posts.items():
+            start = timings["start"]
+            for phase in POST_PHASES:
+                events.append(BuildReport._event(f"{phase} {title}", phase, start, timings[phase], timings["pid"]))
+                start += timings[phase]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: Path) -> None:
+        with path.open("w") as outfile:
+            json.dump(self.trace_events(), outfile)
+
+    def summary(self, limit: int = 10) -> str:
+        lines = [f"{'Stage':<40}{'Seconds':>10}"]
+        lines.extend(f"{name:<40}{seconds:>10.3f}" for name, seconds in self.stages.items())
+        if self.posts:
+            lines.append("")
+            lines.append(f"{'Post phase':<40}{'Seconds':>10}")
+            lines.extend(f"{phase:<40}{seconds:>10.3f}" for phase, seconds in self.post_phases().items())
+            lines.append("")
+            lines.append(f"{'Slowest posts':<40}" + "".join(f"{phase:>10}" for phase in POST_PHASES) + f"{'total':>10}")
+            for title, timings in self.slowest_posts(limit):
+                phases = [timings[phase] for phase in POST_PHASES]
+                lines.append(f"{title[:39]:<40}" + "".join(f"{s:>10.3f}" for s in phases) + f"{sum(phases):>10.3f}")
+        if self.counts:
+            lines.append("")
+            lines.extend(f"{name:<40}{value:>10}" for name, value in self.counts.items())
+        return "\n".join(lines)
+
+    @staticmethod
+    def _event(name: str, category: str, start: float, seconds: float, pid: int) -> Dict[str, Any]:
+        return {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int(seconds * 1e6),
+            "pid": pid,
+            "tid": pid
+        }
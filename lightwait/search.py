@@ -0,0 +1,121 @@
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any, Dict, List
+
+# terms shorter than this are not indexed, and shards are keyed by this many characters
+SHARD_PREFIX = 2
+MAX_TERM = 32
+# shard of terms whose prefix is not plain ascii letters and digits
+OTHER_SHARD = "_"
+# posts listed in each docs-N.json, shard N being those with ids from N * DOC_SHARD_SIZE
+DOC_SHARD_SIZE = 256
+STOP_WORDS = frozenset("""
+an and are as at be but by do for from has have he her his if in is it its me my no not of on or our
+she so than that the their them then there these they this to too us was we were what when which who
+will with you your
+""".split())
+
+_WORD = re.compile(r"[^\W_]+")
+_SHARD_KEY = re.compile(r"[a-z0-9]+")
+# link and image targets, html tags and markdown comment lines carry no searchable words
+_NOISE = re.compile(r"\]\([^)]*\)|<[^>]*>|^\[//\]: #.*$", re.MULTILINE)
+
+
+def settings() -> Dict[str, Any]:
+    """how the index was built, so search.js splits queries into the same terms"""
+    return {
+        "prefix": SHARD_PREFIX,
+        "maxTerm": MAX_TERM,
+        "docShardSize": DOC_SHARD_SIZE,
+        "stopWords": sorted(STOP_WORDS)
+    }
+
+
+def tokenize(text: str) -> List[str]:
+    """distinct lower case terms of the text, in order of first use"""
+    terms = {}
+    for word in _WORD.findall(_NOISE.sub(" ", text).lower()):
+        if SHARD_PREFIX <= len(word) <= MAX_TERM and word not in STOP_WORDS:
+            terms[word] = None
+    return list(terms)
+
+
+def shard_key(term: str) -> str:
+    prefix = term[:SHARD_PREFIX]
+    return prefix if _SHARD_KEY.fullmatch(prefix) else OTHER_SHARD
+
+
+def build_shards(doc_terms: List[List[str]]) -> Dict[str, Dict[str, List[int]]]:
+    """
+    Inverted index split into shards by term prefix
+
+    @param doc_terms: terms of each document, the list position being its id
+    @return: shard key -> term -> ids of the documents holding the term, ascending
+    """
+    shards: Dict[str, Dict[str, List[int]]] = {}
+    for doc_id, terms in enumerate(doc_terms):
+        for term in terms:
+            shards.setdefault(shard_key(term), {}).setdefault(term, []).append(doc_id)
+    return {key: dict(sorted(postings.items())) for key, postings in sorted(shards.items())}
+
+
+def doc_shards(docs: List[Any]) -> Dict[str, List[Any]]:
+    """
+    The list of documents split into shards by id range, so a search downloads
+    only the shards of the documents it shows, and new documents, given the
+    highest ids, only change the last shard
+
+    @return: shard name -> documents with ids in its range
+    """
+    return {f"docs-{n}": docs[n * DOC_SHARD_SIZE:(n + 1) * DOC_SHARD_SIZE]
+            for n in range((len(docs) + DOC_SHARD_SIZE - 1) // DOC_SHARD_SIZE)}
+
+
+class TermCache(object):
+    """
+    Terms of each post, kept with the hash of the markdown they were read
+    from, so only new or edited posts are tokenized again. Entries of
+    posts not looked up since loading are dropped on save()
+    """
+    VERSION = 1
+    CACHE_NAME = "search.json"
+
+    def __init__(self, cache_path: Path):
+        self.path = cache_path / TermCache.CACHE_NAME
+        # title -> [markdown sha256, terms]
+        self.entries: Dict[str, List[Any]] = {}
+        self._used = set()
+        if self.path.exists():
+            try:
+                with self.path.open() as json_file:
+                    data = json.load(json_file)
+                if data.get("version") == TermCache.VERSION:
+                    self.entries = data.get("posts", {})
+            except ValueError:
+                logging.info(f"Ignoring unreadable search cache: {self.path.as_posix()}")
+
+    def terms(self, metadata: Dict[str, Any], markdown_path: Path, markdown_hash: str) -> List[str]:
+        title = metadata["title"]
+        self._used.add(title)
+        # metadata is indexed along with the markdown, so it is part of the key
+        key = [markdown_hash, metadata["description"], metadata["tags"]]
+        cached = self.entries.get(title)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        text = " ".join([metadata["description"], " ".join(metadata["tags"]), markdown_path.read_text()])
+        terms = tokenize(text)
+        self.entries[title] = [key, terms]
+        return terms
+
+    def save(self) -> None:
+        data = {
+            "version": TermCache.VERSION,
+            "posts": {title: entry for title, entry in self.entries.items() if title in self._used}
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as outfile:
+            json.dump(data, outfile)
+        tmp_path.replace(self.path)
@@ -0,0 +1,105 @@
+import functools
+import logging
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from lightwait.lightwait import LightWait
+
+
+class Watcher(object):
+    """
+    Polls directory trees for files which were added, changed or removed
+    """
+
+    def __init__(self, paths: List[Path]):
+        self.paths = paths
+        self.snapshot = self._scan()
+
+    def changes(self) -> List[Path]:
+        """paths changed since the previous call"""
+        current = self._scan()
+        changed = {p for p in current.keys() | self.snapshot.keys() if current.get(p) != self.snapshot.get(p)}
+        self.snapshot = current
+        return sorted(Path(p) for p in changed)
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for path in self.paths:
+            if not path.exists():
+                continue
+            for p in path.rglob("*"):
+                try:
+                    stat = p.stat()
+                except FileNotFoundError:
+                    continue
+                if p.is_file():
+                    snapshot[p.as_posix()] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logging.info(format % args)
+
+
+class DevServer(object):
+    """
+    Serves the docroot over local HTTP and regenerates it when markdown,
+    metadata, templates or static files under the lightwait HOME change.
+    The same LightWait instance is used for every rebuild, so compiled
+    templates, the markdown converter and post metadata stay loaded and
+    each rebuild only renders the outputs whose inputs changed
+    """
+
+    def __init__(self, lightwait: LightWait, docroot: Path, host: str = "localhost", port: int = 8080):
+        self.lightwait = lightwait
+        self.docroot = docroot
+        self.host = host
+        self.port = port
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self.watcher: Optional[Watcher] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self) -> None:
+        self.lightwait.generate(self.docroot)
+        self.watcher = Watcher([self.lightwait.markdown,
+                                self.lightwait.metadata,
+                                self.lightwait.template,
+                                self.lightwait.www])
+        handler = functools.partial(QuietHandler, directory=self.docroot.as_posix())
+        self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        # port 0 picks a free port
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logging.info(f"Serving {self.docroot.as_posix()} at {self.url}")
+
+    def rebuild_if_changed(self) -> Optional[Tuple[List[Path], float]]:
+        """
+        Regenerate if any watched file changed since the last call
+
+        @return: changed paths and the seconds taken to rebuild, or None
+        """
+        changed = self.watcher.changes()
+        if not changed:
+            return None
+        start = time.perf_counter()
+        if any(self.lightwait.metadata in p.parents for p in changed):
+            self.lightwait.reload_metadata()
+        self.lightwait.generate(self.docroot)
+        # ignore changes made by the rebuild itself
+        self.watcher.changes()
+        elapsed = time.perf_counter() - start
+        logging.info(f"Rebuilt {len(changed)} changes in {elapsed:.3f}s")
+        return changed, elapsed
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
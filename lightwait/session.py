@@ -0,0 +1,187 @@
+import functools
+import hmac
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+from lightwait.exception import LightwaitException
+from lightwait.lightwait import LightWait
+from lightwait.report import BuildReport
+
+
+class LightWaitSession(object):
+    """
+    A long lived LightWait for repeated publishes
+
+    Metadata, compiled templates, the markdown converter and the build
+    manifest state stay loaded between requests, so each publish only
+    renders what the request changed. Requests are serialized by one lock,
+    so any number of threads may share a session. Metadata is read again
+    when another process changed the store, or when a request failed
+    part way through, and other processes may import or generate meanwhile
+    as LightWait locks the HOME for each change
+    """
+
+    def __init__(self, lightwait: LightWait, docroot: Optional[Path] = None, jobs: int = 1):
+        self.lightwait = lightwait
+        self.docroot = lightwait.docroot if docroot is None else docroot
+        self.jobs = jobs
+        self._lock = threading.Lock()
+
+    def post(self,
+             src_path: Path,
+             title: Optional[str] = None,
+             description: Optional[str] = None,
+             tags: Optional[str] = None) -> BuildReport:
+        with self._request():
+            self.lightwait.post(src_path, title=title, description=description, tags=tags)
+            return self._generate()
+
+    def update(self,
+               title: str,
+               src_path: Optional[Path] = None,
+               description: Optional[str] = None,
+               tags: Optional[str] = None) -> BuildReport:
+        with self._request():
+            self.lightwait.update(title, src_path=src_path, description=description, tags=tags)
+            return self._generate()
+
+    def delete(self, title: str) -> BuildReport:
+        with self._request():
+            self.lightwait.delete(title)
+            return self._generate()
+
+    def generate(self, full: bool = False) -> BuildReport:
+        with self._request():
+            return self._generate(full)
+
+    @contextmanager
+    def _request(self) -> Iterator[None]:
+        with self._lock:
+            try:
+                yield
+            except BaseException:
+                self.lightwait.reload_metadata()
+                raise
+
+    def _generate(self, full: bool = False) -> BuildReport:
+        return self.lightwait.generate(self.docroot, full=full, jobs=self.jobs)
+
+
+class SessionHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP front of a session: POST to /post, /update, /delete or /generate
+    with a JSON object of the arguments, such as {"path": "/tmp/new.md", "tags": "a,b"}
+
+    Only application/json bodies are accepted, which a web page can only send
+    cross origin after a preflight this server never answers, and with a token
+    the request must also carry it in the TOKEN_HEADER header
+    """
+    ACTIONS = ("post", "update", "delete", "generate")
+    TOKEN_HEADER = "X-Lightwait-Token"
+
+    def __init__(self, session: LightWaitSession, token: Optional[str], *args, **kwargs):
+        self.session = session
+        self.token = token
+        super().__init__(*args, **kwargs)
+
+    def do_POST(self):
+        action = self.path.strip("/")
+        if action not in SessionHandler.ACTIONS:
+            self._reply(404, {"error": f"Unknown request {self.path}"})
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self._reply(415, {"error": "Content-Type must be application/json"})
+            return
+        if self.token is not None and not hmac.compare_digest(
+                self.headers.get(SessionHandler.TOKEN_HEADER, "").encode('utf-8'), self.token.encode('utf-8')):
+            self._reply(403, {"error": f"Missing or wrong {SessionHandler.TOKEN_HEADER}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            args = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(args, dict):
+                raise TypeError("expected a JSON object of arguments")
+            report = self._dispatch(action, args)
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {"error": f"Bad request: {e}"})
+            return
+        except LightwaitException as le:
+            self._reply(400, {"error": str(le)})
+            return
+        except OSError as e:
+            self._reply(400, {"error": f"Unable to read or write: {e}"})
+            return
+        except Exception as e:
+            # a webhook is always answered, even when publishing fails unexpectedly
+            logging.exception(f"Failed request {self.path}")
+            self._reply(500, {"error": f"Internal error: {e}"})
+            return
+        self._reply(200, {
+            "seconds": report.seconds,
+            "counts": report.counts
+        })
+
+    def _dispatch(self, action: str, args: Dict[str, Any]) -> BuildReport:
+        path = Path(args["path"]) if args.get("path") else None
+        if action == "post":
+            if path is None:
+                raise KeyError("path")
+            return self.session.post(path, args.get("title"), args.get("description"), args.get("tags"))
+        if action == "update":
+            return self.session.update(args["title"], path, args.get("description"), args.get("tags"))
+        if action == "delete":
+            return self.session.delete(args["title"])
+        return self.session.generate(bool(args.get("full", False)))
+
+    def _reply(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.info(format % args)
+
+
+class SessionServer(object):
+    """
+    Serves a session over local HTTP, for publishing from webhooks
+    without starting a process per publish. Requests must carry the
+    token, if one is given, and it listens on localhost unless told otherwise
+    """
+
+    def __init__(self,
+                 session: LightWaitSession,
+                 host: str = "localhost",
+                 port: int = 8081,
+                 token: Optional[str] = None):
+        self.session = session
+        self.host = host
+        self.port = port
+        self.token = token
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self) -> None:
+        handler = functools.partial(SessionHandler, self.session, self.token)
+        self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        # port 0 picks a free port
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logging.info(f"Accepting requests at {self.url}")
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,36 @@
+from html import escape
+from typing import List, Optional, Tuple
+
+# most URLs a sitemap file may hold
+MAX_URLS = 50000
+_URLSET = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+_INDEX = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+
+
+def page_url(key: str) -> str:
+    """path of a generated page as linked to: content/a/index.html as content/a/"""
+    if key == "index.html":
+        return ""
+    if key.endswith("/index.html"):
+        return key[:-len("index.html")]
+    return key
+
+
+def sitemap_xml(urls: List[Tuple[str, Optional[str]]]) -> str:
+    """
+    @param urls: each url with the time it last changed, if known
+    """
+    return _document(_URLSET, "url", urls, "</urlset>")
+
+
+def sitemap_index_xml(sitemaps: List[Tuple[str, Optional[str]]]) -> str:
+    return _document(_INDEX, "sitemap", sitemaps, "</sitemapindex>")
+
+
+def _document(start: str, tag: str, entries: List[Tuple[str, Optional[str]]], end: str) -> str:
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', start]
+    for loc, lastmod in entries:
+        lastmod_xml = "" if lastmod is None else f"<lastmod>{lastmod}</lastmod>"
+        lines.append(f"<{tag}><loc>{escape(loc, quote=False)}</loc>{lastmod_xml}</{tag}>")
+    lines.append(end)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,171 @@
+import bisect
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class MetadataStore(object):
+    """
+    Post metadata held in a single JSON document
+
+    The document is loaded once and kept sorted newest first, with each
+    post date parsed once and stored alongside it. Tag membership is
+    derived from one in memory index, so no per-tag files are read or
+    written. Changes are held in memory until save()
+    """
+    VERSION = 1
+    STORE_NAME = "lw_store.json"
+    # metadata layout before the store: a posts file plus one file per tag
+    LEGACY_POSTS_NAME = "lw_posts.json"
+    LEGACY_DIR = "legacy"
+    DATE_FORMAT = '%d %b %Y'
+
+    def __init__(self, metadata_path: Path):
+        self.metadata_path = metadata_path
+        self.path = metadata_path / MetadataStore.STORE_NAME
+        # sorted newest first, ties kept in insertion order
+        self._posts: List[Dict[str, Any]] = []
+        # negated date ordinal of each post, ascending, for bisect
+        self._keys: List[int] = []
+        self._tag_index: Optional[Dict[str, List[int]]] = None
+        self._titles: Optional[Dict[str, Dict[str, Any]]] = None
+        # stat of the document as last loaded or saved, to notice writes by other processes
+        self._stat: Optional[Tuple[int, int]] = None
+        if self.path.exists():
+            self._load()
+        elif (metadata_path / MetadataStore.LEGACY_POSTS_NAME).exists():
+            self._migrate()
+
+    def posts(self) -> List[Dict[str, Any]]:
+        """all post metadata, newest first"""
+        return [dict(p) for p in self._posts]
+
+    def tags(self) -> List[str]:
+        return sorted(self._get_tag_index().keys())
+
+    def tag_posts(self, tag: str) -> List[Dict[str, Any]]:
+        """metadata of the posts with the given tag, newest first"""
+        return [dict(self._posts[i]) for i in self._get_tag_index().get(tag, [])]
+
+    def get(self, title: str) -> Optional[Dict[str, Any]]:
+        metadata = self._get_titles().get(title)
+        return None if metadata is None else dict(metadata)
+
+    def __contains__(self, title: str) -> bool:
+        return title in self._get_titles()
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+    def add(self, metadata: Dict[str, Any]) -> None:
+        key = MetadataStore._sort_key(metadata)
+        index = bisect.bisect_right(self._keys, key)
+        metadata = dict(metadata)
+        self._keys.insert(index, key)
+        self._posts.insert(index, metadata)
+        self._tag_index = None
+        if self._titles is not None:
+            self._titles[metadata["title"]] = metadata
+
+    def is_stale(self) -> bool:
+        """whether the document was written by someone else since it was loaded or saved"""
+        return self._stat_document() != self._stat
+
+    def remove(self, title: str) -> Optional[Dict[str, Any]]:
+        """remove the post with the given title, answering back its metadata"""
+        for index, metadata in enumerate(self._posts):
+            if metadata["title"] == title:
+                del self._posts[index]
+                del self._keys[index]
+                self._tag_index = None
+                if self._titles is not None:
+                    del self._titles[title]
+                return metadata
+        return None
+
+    def replace(self, title: str, metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        replace the post with the given title, answering back its previous metadata.
+        A post keeping its date keeps its place among posts of the same date
+        """
+        for index, previous in enumerate(self._posts):
+            if previous["title"] == title:
+                if MetadataStore._sort_key(metadata) != self._keys[index]:
+                    self.remove(title)
+                    self.add(metadata)
+                    return previous
+                metadata = dict(metadata)
+                self._posts[index] = metadata
+                self._tag_index = None
+                if self._titles is not None:
+                    del self._titles[title]
+                    self._titles[metadata["title"]] = metadata
+                return previous
+        return None
+
+    def save(self) -> None:
+        """write the whole store, replacing the previous document in one step"""
+        data = {
+            "version": MetadataStore.VERSION,
+            "keys": self._keys,
+            "posts": self._posts
+        }
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp_path.open("w") as outfile:
+            json.dump(data, outfile)
+        tmp_path.replace(self.path)
+        self._stat = self._stat_document()
+
+    def _load(self) -> None:
+        self._stat = self._stat_document()
+        with self.path.open() as json_file:
+            data = json.load(json_file)
+        self._posts = data["posts"]
+        self._keys = data["keys"]
+
+    def _migrate(self) -> None:
+        """import the legacy posts file, then move legacy files aside"""
+        legacy_posts = self.metadata_path / MetadataStore.LEGACY_POSTS_NAME
+        with legacy_posts.open() as json_file:
+            posts = json.load(json_file)
+        for metadata in posts:
+            self.add(metadata)
+        self.save()
+        legacy_dir = self.metadata_path / MetadataStore.LEGACY_DIR
+        legacy_dir.mkdir(exist_ok=True)
+        for legacy in self.metadata_path.glob("*.json"):
+            if legacy != self.path:
+                legacy.replace(legacy_dir / legacy.name)
+        logging.info(f"Migrated {len(posts)} posts to {self.path.as_posix()}")
+
+    def _get_tag_index(self) -> Dict[str, List[int]]:
+        if self._tag_index is None:
+            index: Dict[str, List[int]] = {}
+            for i, p in enumerate(self._posts):
+                for tag in dict.fromkeys(p["tags"]):
+                    index.setdefault(tag, []).append(i)
+            self._tag_index = index
+        return self._tag_index
+
+    def _get_titles(self) -> Dict[str, Dict[str, Any]]:
+        if self._titles is None:
+            self._titles = {p["title"]: p for p in self._posts}
+        return self._titles
+
+    def _stat_document(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def parse_date(date: str) -> datetime:
+        return datetime.strptime(date, MetadataStore.DATE_FORMAT)
+
+    @staticmethod
+    def _sort_key(metadata: Dict[str, Any]) -> int:
+        return -MetadataStore.parse_date(metadata["date"]).toordinal()
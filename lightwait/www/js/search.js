@@ -0,0 +1,103 @@
+/*
+ * Client side search over the index written by lightwait generate:
+ * /search/docs-<n>.json lists the posts with ids from n * docShardSize,
+ * and /search/<prefix>.json maps each term starting with a two character
+ * prefix to the ids of the posts holding it. Only the shards of the words
+ * typed, and of the posts shown, are downloaded. /search/settings.json
+ * holds the stop words and term lengths the index was built with, so
+ * queries are split into words the same way.
+ */
+(function () {
+  "use strict";
+  var MAX_RESULTS = 50;
+  var cache = {};
+
+  function load(name) {
+    if (!cache[name]) {
+      cache[name] = fetch("/search/" + name + ".json").then(function (response) {
+        return response.ok ? response.json() : {};
+      });
+    }
+    return cache[name];
+  }
+
+  function shardKey(settings, term) {
+    var prefix = term.slice(0, settings.prefix);
+    return /^[a-z0-9]+$/.test(prefix) ? prefix : "_";
+  }
+
+  // words of the query which may be indexed terms
+  function terms(settings, query) {
+    var stopWords = new Set(settings.stopWords);
+    return (query.toLowerCase().match(/[\p{L}\p{N}]+/gu) || []).filter(function (t) {
+      return t.length >= settings.prefix && t.length <= settings.maxTerm && !stopWords.has(t);
+    });
+  }
+
+  // ids of posts holding a term starting with the given word
+  function matching(settings, word) {
+    return load(shardKey(settings, word)).then(function (shard) {
+      var ids = new Set();
+      Object.keys(shard).forEach(function (term) {
+        if (term.startsWith(word)) {
+          shard[term].forEach(function (id) { ids.add(id); });
+        }
+      });
+      return ids;
+    });
+  }
+
+  function search(query) {
+    return load("settings").then(function (settings) {
+      return searchWith(settings, query);
+    });
+  }
+
+  function searchWith(settings, query) {
+    var words = terms(settings, query);
+    if (!words.length) {
+      return Promise.resolve([]);
+    }
+    return Promise.all(words.map(function (word) {
+      return matching(settings, word);
+    })).then(function (results) {
+      var found = results.reduce(function (a, b) {
+        return new Set(Array.from(a).filter(function (id) { return b.has(id); }));
+      });
+      // newest first, as ids are given oldest first
+      var ids = Array.from(found).sort(function (a, b) { return b - a; }).slice(0, MAX_RESULTS);
+      return Promise.all(ids.map(function (id) {
+        return load("docs-" + Math.floor(id / settings.docShardSize)).then(function (docs) {
+          return docs[id % settings.docShardSize];
+        });
+      }));
+    });
+  }
+
+  document.addEventListener("DOMContentLoaded", function () {
+    var input = document.getElementById("search");
+    var list = document.getElementById("search-results");
+    if (!input || !list) {
+      return;
+    }
+    var pending = 0;
+    input.addEventListener("input", function () {
+      var current = ++pending;
+      search(input.value).then(function (docs) {
+        if (current !== pending) {
+          return;
+        }
+        list.replaceChildren.apply(list, docs.filter(Boolean).map(function (doc) {
+          var li = document.createElement("li");
+          var a = document.createElement("a");
+          var span = document.createElement("span");
+          a.href = doc[0];
+          a.textContent = doc[1];
+          span.textContent = " (" + doc[2] + ")";
+          li.append(a, span);
+          return li;
+        }));
+      });
+    });
+  });
+})();
@@ -0,0 +1,28 @@
+from pathlib import Path
+import pytest
+from lightwait.lightwait import LightWait
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+@pytest.fixture
+def home_lightwait(tmp_path):
+    """
+    LightWait class installing a fresh HOME under a temporary directory
+    """
+    home = tmp_path / "home"
+    home.mkdir()
+
+    class TmpHomeLightWait(LightWait):
+
+        def _get_home_path(self) -> Path:
+            return home
+
+    return TmpHomeLightWait
+
+
+@pytest.fixture
+def docroot(tmp_path):
+    path = tmp_path / "www"
+    path.mkdir()
+    return path
@@ -0,0 +1,41 @@
+import gzip
+from lightwait import assets
+from conftest import RESOURCES
+
+
+class TestAssets():
+
+    def test_minify_css(self):
+        css = "/* comment */\na :hover ,\nb > i {\n  color : red;\n  margin: 0 auto;\n}\n"
+        assert assets.minify_css(css) == "a :hover,b>i{color :red;margin:0 auto}"
+
+    def test_fingerprint(self):
+        assert assets.fingerprint("css/main.css", "3f9a1c2b77") == "css/main.3f9a1c2b.css"
+
+    def test_compress(self, tmp_path):
+        path = tmp_path / "index.html"
+        path.write_text("<html></html>")
+        written = assets.compress(path)
+        assert written[0] == tmp_path / "index.html.gz"
+        assert gzip.decompress(written[0].read_bytes()) == b"<html></html>"
+        # identical content compresses to identical bytes
+        assert assets.compress(path)[0].read_bytes() == written[0].read_bytes()
+
+    def test_generate_assets(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.generate(docroot)
+        hashed = lw.assets["css/main.css"]
+        assert hashed != "css/main.css"
+        assert (docroot / hashed).read_text() == assets.minify_css((lw.www / "css" / "main.css").read_text())
+        assert f'href="/{hashed}"' in (docroot / "index.html").read_text()
+        assert (docroot / "image" / "favicon.ico").exists()
+        assert (docroot / "index.html.gz").exists()
+        assert (docroot / "content" / "rss.xml.gz").exists()
+
+        # an edited stylesheet gets a new name and pages link to it
+        css = lw.www / "css" / "main.css"
+        css.write_text(css.read_text() + "\nh1 { color: red; }\n")
+        lw.generate(docroot)
+        assert lw.assets["css/main.css"] != hashed
+        assert f'href="/{lw.assets["css/main.css"]}"' in (docroot / "index.html").read_text()
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from conftest import RESOURCES
+
+# modules only needed to render, which short commands should not load
+HEAVY_MODULES = ["markdown", "jinja2", "feedgen", "lxml", "PIL", "pkg_resources", "distutils", "http.server",
+                 "http.client", "urllib.request"]
+CHECK = """
+import sys
+from lightwait.cli import cli
+try:
+    cli(sys.argv[1:])
+except SystemExit:
+    pass
+print("loaded:" + ",".join(m for m in {modules!r} if m in sys.modules))
+"""
+
+
+def run_cli(home, *args):
+    code = CHECK.format(modules=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code, *args], capture_output=True, text=True,
+                            env={"HOME": str(home)}, check=True)
+    return result.stdout.splitlines()
+
+
+class TestCli():
+
+    def test_help_startup(self, tmp_path):
+        assert run_cli(tmp_path, "--help")[-1] == "loaded:"
+        # help does not install a HOME
+        assert not (tmp_path / ".lightwait").exists()
+
+    def test_export_startup(self, home_lightwait, tmp_path):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        export = tmp_path / "export"
+        export.mkdir()
+        lines = run_cli(tmp_path / "home", "export", str(export))
+        assert lines == ["Exported 1 files to " + str(export), "loaded:"]
@@ -0,0 +1,41 @@
+import tarfile
+import zipfile
+from conftest import RESOURCES
+
+
+class TestExport():
+
+    def test_export_dir(self, home_lightwait, tmp_path):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "nometadata.md", title="plain", tags="a")
+        target = tmp_path / "export"
+        target.mkdir()
+        written = lw.export(target, jobs=2)
+        assert sorted(p.name for p in written) == ["14-Jul-2022_360a08.md", "plain.md"]
+        exported = (target / "plain.md").read_text()
+        assert exported.startswith("[//]: # (title:plain)\n[//]: # (description:")
+        assert exported.endswith((RESOURCES / "nometadata.md").read_text())
+        body = (RESOURCES / "allmetadata.md").read_text().split("\n", 4)[4]
+        assert (target / "14-Jul-2022_360a08.md").read_text().endswith(body)
+
+        # unchanged targets are skipped, changed ones rewritten
+        (target / "plain.md").write_text("changed")
+        assert lw.export(target) == [target / "plain.md"]
+        assert (target / "plain.md").read_text() == exported
+
+    def test_export_archive(self, home_lightwait, tmp_path):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "nometadata.md", title="plain")
+        target = tmp_path / "export"
+        target.mkdir()
+        lw.export(target)
+        expected = (target / "plain.md").read_bytes()
+
+        assert lw.export(tmp_path / "backup.tar.gz") == [tmp_path / "backup.tar.gz"]
+        with tarfile.open(tmp_path / "backup.tar.gz") as archive:
+            assert archive.extractfile("plain.md").read() == expected
+        lw.export(tmp_path / "backup.zip")
+        with zipfile.ZipFile(tmp_path / "backup.zip") as archive:
+            assert archive.read("plain.md") == expected
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["backup.tar.gz", "backup.zip", "export", "home"]
@@ -0,0 +1,91 @@
+import logging
+import time
+import pytest
+from lightwait import images
+
+
+def _post_with_image(tmp_path, image_bytes=None):
+    src = tmp_path / "src"
+    (src / "img").mkdir(parents=True)
+    (src / "img" / "photo one.png").write_bytes(image_bytes or b"not really a png")
+    post = src / "post.md"
+    post.write_text("[//]: # (date:14 Jul 2022)\n# Photos\n"
+                    "![A photo](img/photo%20one.png \"title\")\n![remote](https://example.com/a.png)\n"
+                    "![missing](img/missing.png)\n")
+    return post
+
+
+class TestImages():
+
+    def test_image_refs(self):
+        text = "![a](img/a.png) ![b](<img/b.jpg>) ![c](/abs.png) ![d](http://x/d.png) ![a](img/a.png)"
+        assert images.image_refs(text) == ["img/a.png", "img/b.jpg"]
+
+    def test_without_pillow(self, home_lightwait, docroot, tmp_path, monkeypatch):
+        monkeypatch.setattr(images, "Image", None)
+        lw = home_lightwait(False)
+        lw.post(_post_with_image(tmp_path), title="photos")
+        name = lw.store.get("photos")["images"]["img/photo%20one.png"]
+        assert (lw.media / name).read_bytes() == b"not really a png"
+        lw.generate(docroot)
+        html = (docroot / "content" / "photos" / "index.html").read_text()
+        assert f'src="/media/{name}"' in html
+        assert 'loading="lazy"' in html
+        assert "srcset" not in html
+        assert (docroot / "media" / name).read_bytes() == b"not really a png"
+
+    def test_without_pillow_reported_once(self, tmp_path, monkeypatch, caplog):
+        monkeypatch.setattr(images, "Image", None)
+        monkeypatch.setattr(images, "_reported_missing", False)
+        with caplog.at_level(logging.INFO):
+            images.ImageProcessor(tmp_path, tmp_path, [], webp=False)
+            assert "Pillow" not in caplog.text
+            images.ImageProcessor(tmp_path, tmp_path, [480], webp=True)
+            images.ImageProcessor(tmp_path, tmp_path, [], webp=True)
+        assert [r.levelno for r in caplog.records if "Pillow" in r.getMessage()] == [logging.INFO]
+
+    def test_shared_image_batch(self, home_lightwait, tmp_path, monkeypatch):
+        src = tmp_path / "src"
+        src.mkdir()
+        (src / "img.png").write_bytes(b"shared image")
+        copy2 = images.copy2
+
+        def slow_copy2(*args):
+            # widen the window in which threads copy the same image
+            copied = copy2(*args)
+            time.sleep(0.01)
+            return copied
+        monkeypatch.setattr(images, "copy2", slow_copy2)
+        files = []
+        for i in range(40):
+            files.append(src / f"post{i}.md")
+            files[-1].write_text(f"[//]: # (title:post{i})\n# Post {i}\n![shared](img.png)\n")
+        lw = home_lightwait(False)
+        results = lw.post_many(files, jobs=8)
+        assert all(error is None for error in results.values())
+        assert len(lw.store) == 40
+        assert [p.name for p in lw.media.iterdir()] == [lw.store.get("post0")["images"]["img.png"]]
+
+    def test_resized_variants(self, home_lightwait, docroot, tmp_path, monkeypatch):
+        image_module = pytest.importorskip("PIL.Image")
+        png = tmp_path / "photo.png"
+        image_module.new("RGB", (1200, 600), "red").save(png)
+        lw = home_lightwait(False)
+        lw.post(_post_with_image(tmp_path, png.read_bytes()), title="photos")
+        stem = lw.store.get("photos")["images"]["img/photo%20one.png"][:-4]
+        lw.generate(docroot)
+        html = (docroot / "content" / "photos" / "index.html").read_text()
+        assert 'width="1200"' in html and 'height="600"' in html
+        assert f"/media/{stem}.480.png 480w, /media/{stem}.960.png 960w, /media/{stem}.png 1200w" in html
+        with image_module.open(docroot / "media" / f"{stem}.480.png") as variant:
+            assert variant.size == (480, 240)
+        if images.ImageProcessor(lw.media, tmp_path, [], True).webp:
+            assert '<picture><source' in html and 'type="image/webp"' in html
+            assert (docroot / "media" / f"{stem}.1200.webp").exists()
+
+        # a repeated build, even of changed posts, does no image work
+        monkeypatch.setattr(images.ImageProcessor, "_process", lambda *a: pytest.fail("image processed again"))
+        markdown_path = lw.markdown / "photos.md"
+        markdown_path.write_text(markdown_path.read_text() + "\nedited\n")
+        lw.generate(docroot)
+        assert "edited" in (docroot / "content" / "photos" / "index.html").read_text()
@@ -1,12 +1,18 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from lightwait.exception import LightwaitException
 from lightwait.lightwait import LightWait
+from lightwait.manifest import BuildManifest
 from pathlib import Path
-import pkg_resources
+from conftest import RESOURCES
 
 
 class NoInitLightWait(LightWait):
 
     def _get_home_path(self) -> Path:
-        return Path(pkg_resources.resource_filename(__name__, "resources/home"))
+        return RESOURCES / "home"
 
     def _install_home_dir(self,
                           base: Path,
@@ -22,7 +28,7 @@ class TestLightWait():
 
     def test_all_metadata(self):
         lw = NoInitLightWait(True)
-        fn=pkg_resources.resource_filename(__name__, "resources/allmetadata.md")
+        fn = RESOURCES / "allmetadata.md"
         md = lw._input_metadata(Path(fn), None, None, None)
         assert md["tags"] == ['research']
         assert "title" in md
@@ -31,7 +37,7 @@ class TestLightWait():
 
     def test_no_metadata(self):
         lw = NoInitLightWait(True)
-        fn=pkg_resources.resource_filename(__name__, "resources/nometadata.md")
+        fn = RESOURCES / "nometadata.md"
         md = lw._input_metadata(Path(fn), None, None, None)
         assert md["tags"] == ['general']
         assert "title" in md
@@ -40,7 +46,7 @@ class TestLightWait():
 
     def test_partial_metadata(self):
         lw = NoInitLightWait(True)
-        fn=pkg_resources.resource_filename(__name__, "resources/partialmetadata.md")
+        fn = RESOURCES / "partialmetadata.md"
         md = lw._input_metadata(Path(fn), None, None, None)
         assert md["tags"] == ['tag1', 'tag2']
         assert "title" in md
@@ -49,13 +55,29 @@ class TestLightWait():
 
     def test_override_metadata(self):
         lw = NoInitLightWait(True)
-        fn=pkg_resources.resource_filename(__name__, "resources/allmetadata.md")
+        fn = RESOURCES / "allmetadata.md"
         md = lw._input_metadata(Path(fn), "override-title", "override-desc", None)
         assert md["tags"] == ['research']
         assert md["title"] == "override-title"
         assert md["description"] == "override-desc"
         assert "date" in md
 
+    def test_header_metadata(self, tmp_path):
+        lw = NoInitLightWait(True)
+        src = tmp_path / "colons.md"
+        body = "[//]: # (title:Ratio 3:2)\n[//]: # (description:Notes (part 1): café)\n\n# Heading\n"
+        # the byte order mark is ignored, and nothing after the first body line is read
+        src.write_bytes(b"\xef\xbb\xbf" + body.encode("utf-8") + b"text\n" * 100000 + b"\xff\xfe")
+        md = lw._input_metadata(src, None, None, None)
+        assert md["title"] == "Ratio-3-2"
+        assert md["description"] == "Notes (part 1): café"
+        assert md["tags"] == ["general"]
+
+        src.write_text("\n## \n\nFirst words: here\n", encoding="utf-8")
+        assert lw._input_metadata(src, None, None, None)["description"] == "First words: here"
+        src.write_text("[//]: # (tags:a)\n", encoding="utf-8")
+        assert lw._input_metadata(src, None, None, None)["description"] == "no good description"
+
     def test_tag_set(self):
         lw = NoInitLightWait(True)
         pj = [{"title": "title", "description": "desc", "tags": ["aaa","aaa"]}]
@@ -71,3 +93,319 @@ class TestLightWait():
         lw = NoInitLightWait(True)
         assert lw.config.get('lw', 'blogTitle') == "Test Title"
         assert lw.config.get('lw', 'blogSubTitle') == "Test Sub"
+
+
+class TestGenerate():
+
+    def test_generate_all(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "partialmetadata.md", title="partial")
+        lw.generate(docroot)
+        assert (docroot / "content" / "14-Jul-2022_360a08" / "index.html").exists()
+        assert (docroot / "content" / "partial" / "index.html").exists()
+        assert (docroot / "tag-research.html").exists()
+        assert (docroot / "tag-tag1.html").exists()
+        assert (docroot / "content" / "rss.xml").exists()
+        assert "Prompts over fine-tune" in (docroot / "index.html").read_text()
+
+    def test_generate_incremental(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "partialmetadata.md", title="partial")
+        lw.generate(docroot)
+        stage = lw.base / "stage"
+        html = list(stage.rglob("*.html"))
+
+        def rendered():
+            changed = [p for p in html if p.stat().st_mtime_ns != 0]
+            for p in html:
+                os.utime(p, ns=(0, 0))
+            return changed
+
+        rendered()
+        lw.generate(docroot)
+        assert rendered() == []
+
+        # edit one post: only that post is rendered again
+        markdown_path = lw.markdown / "partial.md"
+        markdown_path.write_text(markdown_path.read_text() + "\nedited\n")
+        lw.generate(docroot)
+        changed = rendered()
+        assert changed == [stage / "content" / "partial" / "index.html"]
+        assert "edited" in (docroot / "content" / "partial" / "index.html").read_text()
+        # html converted from the markdown before the edit is dropped from the cache
+        assert len(list((lw.base / "cache" / "html").glob("*/*.html"))) == 2
+
+        lw.generate(docroot, full=True)
+        assert len(rendered()) == 6
+
+    def test_report(self, home_lightwait, docroot, tmp_path):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "partialmetadata.md", title="partial")
+        report = lw.generate(docroot)
+        assert lw.last_report is report
+        for stage in ["assets", "posts", "indexes", "feeds", "publish", "generate"]:
+            assert stage in report.stages
+        assert sorted(report.posts) == ["14-Jul-2022_360a08", "partial"]
+        assert report.counts["posts rendered"] == 2
+        assert "Slowest posts" in report.summary()
+        report.write_trace(tmp_path / "trace.json")
+        assert "traceEvents" in json.loads((tmp_path / "trace.json").read_text())
+
+        assert lw.generate(docroot).counts["posts rendered"] == 0
+
+    def test_publish(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.config.set('lw', 'feedAtom', 'yes')
+        lw.post(RESOURCES / "allmetadata.md")
+        (docroot / "robots.txt").write_text("not ours")
+        lw.generate(docroot)
+        published = sorted(p for p in docroot.rglob("*") if p.is_file())
+        assert (docroot / "content" / "atom.xml").exists()
+        for p in published:
+            os.utime(p, ns=(0, 0))
+
+        # a full rebuild produces identical bytes, so nothing is published
+        lw.generate(docroot, full=True)
+        assert [p for p in published if p.stat().st_mtime_ns != 0] == []
+
+        # outputs no longer generated are removed, files not published by us are kept
+        lw.config.set('lw', 'feedAtom', 'no')
+        lw.generate(docroot)
+        assert not (docroot / "content" / "atom.xml").exists()
+        assert not (lw.base / "stage" / "content" / "atom.xml").exists()
+        assert (docroot / "robots.txt").exists()
+        assert not list(docroot.rglob("*.tmp"))
+
+    def test_generate_parallel(self, home_lightwait, tmp_path):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "partialmetadata.md", title="partial")
+        lw.post(RESOURCES / "nometadata.md", title="none")
+        serial = tmp_path / "serial"
+        parallel = tmp_path / "parallel"
+        lw.generate(serial, jobs=1)
+        lw.generate(parallel, jobs=3)
+        serial_html = sorted(p.relative_to(serial) for p in serial.rglob("*.html"))
+        assert serial_html == sorted(p.relative_to(parallel) for p in parallel.rglob("*.html"))
+        for p in serial_html:
+            assert (serial / p).read_bytes() == (parallel / p).read_bytes()
+
+    def test_template_cache(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.generate(docroot)
+        assert lw._get_template("main.index") is lw._get_template("main.index")
+        assert list((lw.base / "cache" / "jinja").iterdir())
+
+        # an edited template is picked up by the same instance
+        base = lw.template / "base.index"
+        base.write_text(base.read_text().replace("[ Home ]", "[ Start ]"))
+        lw.generate(docroot)
+        assert "[ Start ]" in (docroot / "index.html").read_text()
+        assert "[ Start ]" in (docroot / "content" / "14-Jul-2022_360a08" / "index.html").read_text()
+
+    def test_paginate(self):
+        posts = list(range(7))
+        assert LightWait._paginate(posts, 0) == (posts, [])
+        assert LightWait._paginate(posts, 10) == (posts, [])
+        assert LightWait._paginate(posts, 2) == ([0, 1, 2], [[5, 6], [3, 4]])
+        # new posts change the first page and add archive pages, older pages are unchanged
+        assert LightWait._paginate([-1] + posts, 2) == ([-1, 0], [[5, 6], [3, 4], [1, 2]])
+        assert LightWait._paginate([-2, -1] + posts, 2) == ([-2, -1, 0], [[5, 6], [3, 4], [1, 2]])
+
+    def test_generate_pages(self, home_lightwait, docroot, tmp_path):
+        lw = home_lightwait(False)
+        lw.config.set('lw', 'pageSize', '2')
+        for day in range(1, 6):
+            src = tmp_path / f"day{day}.md"
+            src.write_text(f"[//]: # (title:day{day})\n[//]: # (tags:daily)\n[//]: # (date:0{day} Jan 2022)\n# Day {day}\n")
+            lw.post(src)
+        lw.generate(docroot)
+        index = (docroot / "index.html").read_text()
+        assert "day5" in index and "day3" in index and "day2" not in index
+        assert 'href="/page/1/"' in index
+        page = (docroot / "page" / "1" / "index.html").read_text()
+        assert "day2" in page and "day1" in page
+        assert 'href="/"' in page
+        assert (docroot / "tag-daily" / "page" / "1.html").exists()
+        assert 'href="/tag-daily/page/1.html"' in (docroot / "tag-daily.html").read_text()
+
+    def test_generate_sitemap(self, home_lightwait, docroot, tmp_path):
+        lw = home_lightwait(False)
+        lw.config.set('lw', 'sitemapSize', '3')
+        for day in range(1, 4):
+            src = tmp_path / f"day{day}.md"
+            src.write_text(f"[//]: # (title:day{day})\n[//]: # (tags:daily)\n[//]: # (date:0{day} Jan 2022)\n# Day {day}\n")
+            lw.post(src)
+        lw.generate(docroot)
+        index = (docroot / "sitemap.xml").read_text()
+        assert "<loc>http://localhost:8080/sitemap-1.xml</loc><lastmod>" in index
+        assert "sitemap-2.xml" in index and "sitemap-3.xml" not in index
+        first = (docroot / "sitemap-1.xml").read_text()
+        assert first.index("content/day1/</loc><lastmod>") < first.index("content/day3/")
+        second = (docroot / "sitemap-2.xml").read_text()
+        assert "<loc>http://localhost:8080/</loc><lastmod>" in second
+        assert "<loc>http://localhost:8080/tag-daily.html</loc>" in second
+
+        # lastmod of unchanged pages stays, and only the last sitemaps change for a new post
+        mtime = (lw.base / lw.STAGE / "sitemap-1.xml").stat().st_mtime_ns
+        lastmod = BuildManifest(lw.base / lw.BUILD_MANIFEST, lw.base / lw.STAGE).modified
+        src = tmp_path / "day4.md"
+        src.write_text("[//]: # (title:day4)\n[//]: # (tags:other)\n[//]: # (date:04 Jan 2022)\n# Day 4\n")
+        lw.post(src)
+        lw.generate(docroot)
+        assert (lw.base / lw.STAGE / "sitemap-1.xml").stat().st_mtime_ns == mtime
+        assert "content/day4/" in (docroot / "sitemap-2.xml").read_text()
+        assert "tag-other.html" in (docroot / "sitemap-3.xml").read_text()
+        modified = BuildManifest(lw.base / lw.BUILD_MANIFEST, lw.base / lw.STAGE).modified
+        assert modified["content/day1/index.html"] == lastmod["content/day1/index.html"]
+
+    def test_related_posts(self, home_lightwait, docroot, tmp_path):
+        lw = home_lightwait(False)
+        for name, tags in [("one", "a,b"), ("two", "a,b"), ("three", "c")]:
+            lw.post(RESOURCES / "nometadata.md", title=name, description=f"about {name}", tags=tags)
+        lw.generate(docroot)
+        assert "about two" in (docroot / "content" / "one" / "index.html").read_text()
+        assert "Related" not in (docroot / "content" / "three" / "index.html").read_text()
+
+    def test_generate_feeds(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.config.set('lw', 'feedSize', '1')
+        lw.config.set('lw', 'feedAtom', 'yes')
+        lw.config.set('lw', 'feedTags', 'yes')
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "nometadata.md", title="newest", tags="research")
+        lw.generate(docroot)
+        rss = (docroot / "content" / "rss.xml").read_text()
+        assert "<title>newest</title>" in rss
+        assert "14-Jul-2022_360a08" not in rss
+        assert "content/rss.xml" in rss
+        atom = (docroot / "content" / "atom.xml").read_text()
+        assert "<title>newest</title>" in atom
+        assert "content/atom.xml" in atom
+        assert "newest" in (docroot / "content" / "rss-research.xml").read_text()
+        assert (docroot / "content" / "atom-research.xml").exists()
+
+        # an older post does not change the capped feed
+        os.utime(docroot / "content" / "rss.xml", ns=(0, 0))
+        lw.post(RESOURCES / "partialmetadata.md", title="older")
+        lw.generate(docroot)
+        assert (docroot / "content" / "rss.xml").stat().st_mtime_ns == 0
+
+
+class TestPostMany():
+
+    def test_post_many(self, home_lightwait, tmp_path):
+        lw = home_lightwait(False)
+        src = tmp_path / "src"
+        src.mkdir()
+        (src / "dup.md").write_text("[//]: # (title:14-Jul-2022_360a08)\n## Same title\n")
+        (src / "bad.md").write_text("[//]: # (date:sometime)\n## Bad date\n")
+        files = [RESOURCES / "allmetadata.md",
+                 RESOURCES / "partialmetadata.md",
+                 src / "dup.md",
+                 src / "bad.md"]
+        results = lw.post_many(files, jobs=2)
+        assert list(results) == files
+        assert results[files[0]] is None
+        assert results[files[1]] is None
+        assert "already exists" in str(results[files[2]])
+        assert "sometime" in str(results[files[3]])
+        assert len(lw.store) == 2
+        assert (lw.markdown / "14-Jul-2022_360a08.md").exists()
+        # saved once and readable by a new instance
+        assert len(home_lightwait(False).store) == 2
+
+    def test_post_many_existing(self, home_lightwait):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        results = lw.post_many([RESOURCES / "allmetadata.md"])
+        assert "already exists" in str(results[RESOURCES / "allmetadata.md"])
+
+
+class TestUpdateDelete():
+
+    def test_update(self, home_lightwait, docroot, tmp_path):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "partialmetadata.md", title="partial")
+        lw.generate(docroot)
+
+        # posts of the same date keep their order
+        order = [p["title"] for p in lw.store.posts()]
+        lw.update("14-Jul-2022_360a08", description="Prompts over fine-tune")
+        assert [p["title"] for p in lw.store.posts()] == order
+        lw.update("partial", tags="tag2,other")
+        report = lw.generate(docroot)
+        assert report.counts["posts rendered"] == 1
+        assert not (docroot / "tag-tag1.html").exists()
+        assert "partial" in (docroot / "tag-other.html").read_text()
+        assert lw.store.get("partial")["description"] == "Heading"
+
+        # metadata the new markdown does not declare is kept
+        src = tmp_path / "partial.md"
+        src.write_text("[//]: # (description:Rewritten)\n## Heading\nNew body\n")
+        lw.update("partial", src_path=src)
+        lw.generate(docroot)
+        metadata = home_lightwait(False).store.get("partial")
+        assert metadata["description"] == "Rewritten"
+        assert metadata["tags"] == ["tag2", "other"]
+        assert metadata["date"] == "14 Jul 2022"
+        assert "New body" in (docroot / "content" / "partial" / "index.html").read_text()
+
+        with pytest.raises(LightwaitException):
+            lw.update("missing", tags="any")
+
+    def test_delete(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.post(RESOURCES / "partialmetadata.md", title="partial")
+        lw.generate(docroot)
+
+        lw.delete("partial")
+        report = lw.generate(docroot)
+        assert report.counts["posts rendered"] == 0
+        assert not (docroot / "content" / "partial").exists()
+        assert not (docroot / "tag-tag1.html").exists()
+        assert (docroot / "tag-research.html").exists()
+        assert "partial" not in (docroot / "index.html").read_text()
+        assert not (lw.markdown / "partial.md").exists()
+        assert home_lightwait(False).store.get("partial") is None
+
+        with pytest.raises(LightwaitException):
+            lw.delete("partial")
+
+
+class TestConcurrentHome():
+
+    def test_concurrent_posts(self, home_lightwait, docroot):
+        # separate instances, each holding the metadata loaded before the others posted
+        instances = [home_lightwait(False) for _ in range(6)]
+        for lw in instances:
+            len(lw.store)
+
+        def post(i):
+            instances[i].post(RESOURCES / "nometadata.md", title=f"post-{i}")
+            instances[i].generate(docroot)
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(post, range(6)))
+        titles = sorted(p["title"] for p in home_lightwait(False).store.posts())
+        assert titles == [f"post-{i}" for i in range(6)]
+        instances[0].generate(docroot)
+        assert all((docroot / "content" / f"post-{i}" / "index.html").exists() for i in range(6))
+        assert not list((home_lightwait(False).base / "markdown").glob(".*.tmp"))
+
+    def test_refresh_metadata(self, home_lightwait):
+        lw = home_lightwait(False)
+        assert len(lw.store) == 0
+        home_lightwait(False).post(RESOURCES / "allmetadata.md")
+        assert len(lw.store) == 0
+        lw.refresh_metadata()
+        assert len(lw.store) == 1
+        # a title taken by another process is refused
+        with pytest.raises(LightwaitException):
+            home_lightwait(False).post(RESOURCES / "allmetadata.md")
@@ -0,0 +1,60 @@
+from lightwait.related import RelatedPosts
+
+
+def _posts(tags_by_title):
+    """posts newest first, in the given order"""
+    return [{"title": title, "tags": tags, "date": "01 Jan 2022"} for title, tags in tags_by_title]
+
+
+class TestRelatedPosts():
+
+    def test_shared_tags(self, tmp_path):
+        posts = _posts([("a", ["python", "web"]), ("b", ["python"]), ("c", ["web", "python"]),
+                        ("d", ["cooking"]), ("e", ["python", "rare"]), ("f", ["rare"])])
+        related = RelatedPosts(tmp_path, limit=2).compute(posts)
+        # sharing two tags beats one, then the nearest in date
+        assert related["a"] == ["c", "b"]
+        # a rare tag counts for more than a common one
+        assert related["e"][0] == "f"
+        assert related["d"] == []
+
+    def test_window(self, tmp_path):
+        posts = _posts([(f"p{i}", ["common"]) for i in range(10)])
+        related = RelatedPosts(tmp_path, limit=10, window=2).compute(posts)
+        assert sorted(related["p5"]) == ["p3", "p4", "p6", "p7"]
+
+    def test_incremental(self, tmp_path, monkeypatch):
+        posts = _posts([(f"p{i}", ["common", f"t{i % 3}"]) for i in range(20)])
+        related = RelatedPosts(tmp_path, limit=3, window=2)
+        full = related.compute(posts)
+        related.save()
+
+        computed = []
+        original = RelatedPosts._compute_one
+        monkeypatch.setattr(RelatedPosts, "_compute_one",
+                            lambda self, title, *args: computed.append(title) or original(self, title, *args))
+        loaded = RelatedPosts(tmp_path, limit=3, window=2)
+        assert loaded.compute(posts) == full
+        assert computed == []
+
+        # a new post only changes the lists of posts near it in its tags
+        posts.insert(0, {"title": "new", "tags": ["t1"], "date": "02 Jan 2022"})
+        incremental = loaded.compute(posts)
+        assert "new" in computed
+        assert len(computed) < len(posts)
+        assert incremental == RelatedPosts(tmp_path / "fresh", limit=3, window=2).compute(posts)
+
+    def test_delete_after_move(self, tmp_path):
+        related = RelatedPosts(tmp_path, limit=3, window=1)
+        related.compute(_posts([("x", ["a"]), ("y", ["a"]), ("z", ["a"]), ("w", ["a"])]))
+        # a post may move within its date, away from posts listing it, without changing
+        related.compute(_posts([("y", ["a"]), ("z", ["a"]), ("w", ["a"]), ("x", ["a"])]))
+        lists = related.compute(_posts([("y", ["a"]), ("z", ["a"]), ("w", ["a"])]))
+        assert all(other in lists for others in lists.values() for other in others)
+
+    def test_delete_after_retag(self, tmp_path):
+        related = RelatedPosts(tmp_path, limit=3, window=1)
+        related.compute(_posts([("x", ["a"]), ("y", ["a", "b"]), ("z", ["b"]), ("w", ["b"])]))
+        related.compute(_posts([("x", ["b"]), ("y", ["a", "b"]), ("z", ["b"]), ("w", ["b"])]))
+        lists = related.compute(_posts([("y", ["a", "b"]), ("z", ["b"]), ("w", ["b"])]))
+        assert all(other in lists for others in lists.values() for other in others)
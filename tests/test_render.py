@@ -0,0 +1,40 @@
+import hashlib
+from lightwait.render import MarkdownConverter
+
+
+class TestMarkdownConverter():
+
+    def test_convert_cached(self, tmp_path, monkeypatch):
+        converter = MarkdownConverter([], tmp_path)
+        html = converter.convert("## Heading\nsome *text*")
+        assert html == "<h2>Heading</h2>\n<p>some <em>text</em></p>"
+
+        def no_parse(text):
+            raise AssertionError("markdown parsed again")
+
+        # a new converter reads the cached html without parsing
+        cached = MarkdownConverter([], tmp_path)
+        monkeypatch.setattr(cached.md, "convert", no_parse)
+        assert cached.convert("## Heading\nsome *text*") == html
+
+    def test_extensions_change_key(self, tmp_path):
+        text = "~~~\ncode\n~~~"
+        plain = MarkdownConverter([], tmp_path).convert(text)
+        fenced = MarkdownConverter(["fenced_code"], tmp_path).convert(text)
+        assert plain != fenced
+        assert "<pre><code>code" in fenced
+
+    def test_reset_between_documents(self, tmp_path):
+        converter = MarkdownConverter(["footnotes"], tmp_path)
+        first = converter.convert("one[^1]\n\n[^1]: first note")
+        second = converter.convert("two")
+        assert "first note" in first
+        assert "first note" not in second
+
+    def test_prune(self, tmp_path):
+        converter = MarkdownConverter([], tmp_path)
+        converter.convert("kept")
+        converter.convert("edited away")
+        kept = converter.key(hashlib.sha256(b"kept").hexdigest())
+        assert converter.prune({kept}) == 1
+        assert [p.stem for p in (tmp_path / "html").glob("*/*.html")] == [kept]
@@ -0,0 +1,86 @@
+import json
+import shutil
+import subprocess
+import pytest
+from lightwait import search
+from conftest import RESOURCES
+
+
+# runs www/js/search.js on a query against a generated docroot, printing the hrefs found
+SEARCH_JS = """
+const fs = require("fs");
+const [script, docroot, query] = process.argv.slice(1);
+global.fetch = (url) => {
+  const path = docroot + url;
+  const ok = fs.existsSync(path);
+  return Promise.resolve({ok: ok, json: () => Promise.resolve(ok ? JSON.parse(fs.readFileSync(path)) : null)});
+};
+const handlers = {};
+let onInput;
+const list = {replaceChildren: (...items) => console.log(JSON.stringify(items.map((li) => li.children[0].href)))};
+global.document = {
+  addEventListener: (event, handler) => { handlers[event] = handler; },
+  getElementById: (id) => id === "search" ? {value: query, addEventListener: (e, h) => { onInput = h; }} : list,
+  createElement: () => ({children: [], append(...c) { this.children.push(...c); }})
+};
+eval(fs.readFileSync(script, "utf8"));
+handlers.DOMContentLoaded();
+onInput();
+"""
+
+
+def _search_js(lw, docroot, query):
+    script = docroot / lw.assets["js/search.js"]
+    result = subprocess.run(["node", "-e", SEARCH_JS, str(script), str(docroot), query],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+class TestSearch():
+
+    def test_tokenize(self):
+        text = "[//]: # (title:x)\n# The Quick fox\nSee [the docs](https://example.com/docs) <b>and</b> Quick_Start a"
+        assert search.tokenize(text) == ["quick", "fox", "see", "docs", "start"]
+
+    def test_build_shards(self):
+        shards = search.build_shards([["python", "fox"], ["pyramid", "été"], ["python"]])
+        assert shards == {
+            "_": {"été": [1]},
+            "fo": {"fox": [0]},
+            "py": {"pyramid": [1], "python": [0, 2]}
+        }
+
+    def test_doc_shards(self, monkeypatch):
+        monkeypatch.setattr(search, "DOC_SHARD_SIZE", 2)
+        assert search.doc_shards([]) == {}
+        assert search.doc_shards(["a", "b", "c"]) == {"docs-0": ["a", "b"], "docs-1": ["c"]}
+
+    def test_generate_search(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.generate(docroot)
+        docs = json.loads((docroot / "search" / "docs-0.json").read_text())
+        assert docs == [["/content/14-Jul-2022_360a08/", "Prompts over fine-tune", "14 Jul 2022"]]
+        assert json.loads((docroot / "search" / "pr.json").read_text()) == {"prompts": [0]}
+        assert json.loads((docroot / "search" / "re.json").read_text())["research"] == [0]
+        assert "js/search" in (docroot / "index.html").read_text()
+
+        # a newer post only rewrites the shards of its terms
+        stage = lw.base / lw.STAGE / "search"
+        mtime = (stage / "pr.json").stat().st_mtime_ns
+        lw.post(RESOURCES / "nometadata.md", title="first", description="zebra crossing", tags="walk")
+        lw.generate(docroot)
+        assert (stage / "pr.json").stat().st_mtime_ns == mtime
+        assert json.loads((docroot / "search" / "ze.json").read_text()) == {"zebra": [1]}
+        assert json.loads((docroot / "search" / "docs-0.json").read_text())[1][0] == "/content/first/"
+
+    @pytest.mark.skipif(shutil.which("node") is None, reason="needs node to run search.js")
+    def test_query_stop_words(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md")
+        lw.generate(docroot)
+        assert json.loads((docroot / "search" / "settings.json").read_text())["stopWords"][0] == "an"
+        # stop words and words too long to be indexed are left out of queries, as they are of the index
+        for query in ["prompts", "the prompts", "prompts and research", "prompts " + "x" * 40]:
+            assert _search_js(lw, docroot, query) == ["/content/14-Jul-2022_360a08/"]
+        assert _search_js(lw, docroot, "prompts zebra") == []
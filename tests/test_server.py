@@ -0,0 +1,38 @@
+from urllib.request import urlopen
+from lightwait.server import DevServer, Watcher
+from conftest import RESOURCES
+
+
+class TestWatcher():
+
+    def test_changes(self, tmp_path):
+        (tmp_path / "a.md").write_text("a")
+        watcher = Watcher([tmp_path, tmp_path / "missing"])
+        assert watcher.changes() == []
+        (tmp_path / "a.md").write_text("changed")
+        (tmp_path / "b.md").write_text("b")
+        assert watcher.changes() == [tmp_path / "a.md", tmp_path / "b.md"]
+        (tmp_path / "b.md").unlink()
+        assert watcher.changes() == [tmp_path / "b.md"]
+
+
+class TestDevServer():
+
+    def test_serve_and_rebuild(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        lw.post(RESOURCES / "allmetadata.md", title="served")
+        server = DevServer(lw, docroot, port=0)
+        server.start()
+        try:
+            assert server.rebuild_if_changed() is None
+            with urlopen(server.url + "content/served/") as response:
+                assert b"Deeper" in response.read()
+
+            markdown_path = lw.markdown / "served.md"
+            markdown_path.write_text(markdown_path.read_text() + "\nlive edit\n")
+            changed, _ = server.rebuild_if_changed()
+            assert changed == [markdown_path]
+            with urlopen(server.url + "content/served/") as response:
+                assert b"live edit" in response.read()
+        finally:
+            server.stop()
@@ -0,0 +1,119 @@
+import json
+import threading
+import pytest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from lightwait.session import LightWaitSession, SessionServer
+from conftest import RESOURCES
+
+
+def _request(server, action, args, headers=None):
+    if headers is None:
+        headers = {"Content-Type": "application/json"}
+    request = Request(server.url + action, data=json.dumps(args).encode('utf-8'), headers=headers, method="POST")
+    with urlopen(request) as response:
+        return json.loads(response.read())
+
+
+class TestLightWaitSession():
+
+    def test_post_update_delete(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        session = LightWaitSession(lw, docroot)
+        report = session.post(RESOURCES / "allmetadata.md", title="first")
+        assert report.counts["posts rendered"] == 1
+        assert (docroot / "content" / "first" / "index.html").exists()
+
+        report = session.update("first", description="changed", tags="moved")
+        assert report.counts["posts rendered"] == 1
+        assert (docroot / "tag-moved.html").exists()
+        assert not (docroot / "tag-research.html").exists()
+        assert "changed" in (docroot / "index.html").read_text()
+
+        session.delete("first")
+        assert not (docroot / "content" / "first").exists()
+        assert len(lw.store) == 0
+
+    def test_concurrent_posts(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        session = LightWaitSession(lw, docroot)
+        threads = [threading.Thread(target=session.post, args=(RESOURCES / "nometadata.md", f"post-{i}"))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(p["title"] for p in lw.store.posts()) == ["post-0", "post-1", "post-2", "post-3"]
+        assert all((docroot / "content" / f"post-{i}" / "index.html").exists() for i in range(4))
+
+    def test_reload_changed_store(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        session = LightWaitSession(lw, docroot)
+        session.generate()
+        # another process posts
+        home_lightwait(False).post(RESOURCES / "allmetadata.md", title="elsewhere")
+        session.generate()
+        assert (docroot / "content" / "elsewhere" / "index.html").exists()
+
+
+class TestSessionServer():
+
+    def test_requests(self, home_lightwait, docroot):
+        server = SessionServer(LightWaitSession(home_lightwait(False), docroot), port=0)
+        server.start()
+        try:
+            body = _request(server, "post", {"path": str(RESOURCES / "allmetadata.md"), "title": "served"})
+            assert body["counts"]["posts rendered"] == 1
+            assert (docroot / "content" / "served" / "index.html").exists()
+            try:
+                _request(server, "delete", {"title": "missing"})
+                assert False
+            except HTTPError as e:
+                assert e.code == 400
+                assert "missing" in json.loads(e.read())["error"]
+        finally:
+            server.stop()
+
+    def test_request_errors(self, home_lightwait, docroot, tmp_path, monkeypatch):
+        session = LightWaitSession(home_lightwait(False), docroot)
+        server = SessionServer(session, port=0)
+        server.start()
+        try:
+            for action, args, code in [("post", {"path": str(tmp_path / "missing.md")}, 400),
+                                       ("post", ["not", "an", "object"], 400)]:
+                with pytest.raises(HTTPError) as e:
+                    _request(server, action, args)
+                assert e.value.code == code
+                assert "error" in json.loads(e.value.read())
+
+            def fail(full=False):
+                raise RuntimeError("boom")
+            monkeypatch.setattr(session, "generate", fail)
+            with pytest.raises(HTTPError) as e:
+                _request(server, "generate", {})
+            assert e.value.code == 500
+            assert "boom" in json.loads(e.value.read())["error"]
+        finally:
+            server.stop()
+
+    def test_cross_origin_requests(self, home_lightwait, docroot):
+        lw = home_lightwait(False)
+        server = SessionServer(LightWaitSession(lw, docroot), port=0, token="secret")
+        server.start()
+        try:
+            args = {"path": str(RESOURCES / "allmetadata.md"), "title": "leaked"}
+            # a page may post text/plain cross origin without a preflight
+            for headers, code in [({"Content-Type": "text/plain"}, 415),
+                                  ({"Content-Type": "application/json"}, 403),
+                                  ({"Content-Type": "application/json", "X-Lightwait-Token": "wrong"}, 403)]:
+                with pytest.raises(HTTPError) as e:
+                    _request(server, "post", args, headers)
+                assert e.value.code == code
+            assert len(lw.store) == 0
+            assert not (docroot / "content" / "leaked").exists()
+
+            _request(server, "post", args, {"Content-Type": "application/json; charset=utf-8",
+                                            "X-Lightwait-Token": "secret"})
+            assert (docroot / "content" / "leaked" / "index.html").exists()
+        finally:
+            server.stop()
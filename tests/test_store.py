@@ -0,0 +1,73 @@
+import json
+from lightwait.store import MetadataStore
+
+
+def _post(title, date, tags):
+    return {"title": title, "description": "desc " + title, "tags": tags, "date": date}
+
+
+class TestMetadataStore():
+
+    def test_sorted_newest_first(self, tmp_path):
+        store = MetadataStore(tmp_path)
+        store.add(_post("old", "01 Jan 2020", ["a"]))
+        store.add(_post("new", "01 Jan 2022", ["a", "b"]))
+        store.add(_post("same-day", "01 Jan 2020", ["b"]))
+        assert [p["title"] for p in store.posts()] == ["new", "old", "same-day"]
+        assert [p["title"] for p in store.tag_posts("b")] == ["new", "same-day"]
+        assert store.tags() == ["a", "b"]
+        assert "old" in store
+        assert store.get("missing") is None
+
+    def test_save_and_load(self, tmp_path):
+        store = MetadataStore(tmp_path)
+        store.add(_post("one", "02 Feb 2021", ["a"]))
+        store.add(_post("two", "03 Feb 2021", ["a"]))
+        store.save()
+        loaded = MetadataStore(tmp_path)
+        assert loaded.posts() == store.posts()
+        loaded.add(_post("three", "01 Feb 2021", ["c"]))
+        assert [p["title"] for p in loaded.posts()] == ["two", "one", "three"]
+
+    def test_remove(self, tmp_path):
+        store = MetadataStore(tmp_path)
+        store.add(_post("one", "02 Feb 2021", ["a"]))
+        store.add(_post("two", "03 Feb 2021", ["a", "b"]))
+        assert store.tags() == ["a", "b"]
+        assert store.remove("two")["title"] == "two"
+        assert store.remove("two") is None
+        assert "two" not in store
+        assert store.tags() == ["a"]
+        store.add(_post("three", "01 Feb 2021", ["c"]))
+        assert [p["title"] for p in store.posts()] == ["one", "three"]
+
+    def test_replace(self, tmp_path):
+        store = MetadataStore(tmp_path)
+        for title in ["a", "b", "c"]:
+            store.add(_post(title, "02 Feb 2021", ["a"]))
+        assert store.replace("a", _post("a", "02 Feb 2021", ["b"]))["tags"] == ["a"]
+        assert [p["title"] for p in store.posts()] == ["a", "b", "c"]
+        assert [p["title"] for p in store.tag_posts("b")] == ["a"]
+        # a new date moves the post
+        store.replace("b", _post("b", "03 Feb 2021", ["a"]))
+        assert [p["title"] for p in store.posts()] == ["b", "a", "c"]
+        assert store.replace("missing", _post("missing", "02 Feb 2021", ["a"])) is None
+        assert "missing" not in store
+
+    def test_posts_are_copies(self, tmp_path):
+        store = MetadataStore(tmp_path)
+        store.add(_post("one", "02 Feb 2021", ["a"]))
+        store.posts()[0]["content"] = "html"
+        assert "content" not in store.get("one")
+
+    def test_migrate_legacy(self, tmp_path):
+        posts = [_post("one", "02 Feb 2021", ["a"]), _post("two", "03 Feb 2021", ["a", "b"])]
+        (tmp_path / "lw_posts.json").write_text(json.dumps(posts))
+        (tmp_path / "a.json").write_text(json.dumps(posts))
+        (tmp_path / "b.json").write_text(json.dumps(posts[1:]))
+        store = MetadataStore(tmp_path)
+        assert [p["title"] for p in store.posts()] == ["two", "one"]
+        assert [p["title"] for p in store.tag_posts("b")] == ["two"]
+        assert sorted(p.name for p in tmp_path.glob("*.json")) == [MetadataStore.STORE_NAME]
+        assert (tmp_path / "legacy" / "lw_posts.json").exists()
+        assert MetadataStore(tmp_path).posts() == store.posts()